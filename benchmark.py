@@ -0,0 +1,1510 @@
+"""
+Local benchmarks for function_app. Nothing here talks to the real upstream services.
+
+Usage:
+    python benchmark.py                 # run every benchmark
+    python benchmark.py snapshot_load   # run selected benchmarks by name
+
+Benchmarks that check something (the startup budget, command sync) make the script exit with status 1 when it fails.
+"""
+import collections
+import contextlib
+import copy
+import io
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import azure.functions as func
+import requests
+import yaml
+from nacl.signing import SigningKey, VerifyKey
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+import function_app
+import register_commands
+
+logging.getLogger().setLevel(logging.WARNING)
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_leaderboard.json")
+OCR_CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_ocr_corpus.json")
+INTERACTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_interactions.json")
+COMMANDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discord_commands.yaml")
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__.removeprefix("bench_")] = func
+    return func
+
+
+def measure(func, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def report(label, samples, extra=""):
+    print(f"  {label:<40} p50 {statistics.median(samples) * 1000:9.3f} ms   p95 {percentile(samples, 0.95) * 1000:9.3f} ms   "
+          f"p99 {percentile(samples, 0.99) * 1000:9.3f} ms   n={len(samples)}{extra}")
+
+
+def make_board(size, hardcore):
+    """Builds a synthetic leaderboard of `size` characters from the characters in test_leaderboard.json."""
+    with open(FIXTURE_PATH, "r") as file:
+        templates = [entry["character_info"] for entry in json.load(file)]
+
+    board = []
+    for i in range(size):
+        character_info = copy.deepcopy(templates[i % len(templates)])
+        character_info["id"] = f"{i:024x}"
+        character_info["name"] = f"Player{i} ({character_info['name'].split()[-1].strip('()')})"
+        character_info["raptureLevel"] = str(max(1, 500 - i // 20))
+        character_info["rating"] = str(10 * (size - i))
+        character_info["isHardcore"] = hardcore
+        if hardcore:
+            character_info["deaths"] = "0" if i % 3 else "1"
+        board.append(character_info)
+    return board
+
+
+def to_records(board):
+    return [function_app.CharacterRecord.from_api(character_info) for character_info in board]
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops connections when many callers connect at once
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients that timed out or were hedged away hang up before the stub answers
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+# Bytes a dripping stub sends at a time
+DRIP_SIZE = 256
+
+
+class StubServer:
+    """
+    Serves fixed responses by path prefix on a local port, whatever the request method, after
+    `delay` seconds. `hits` counts the requests per matched prefix (None for a 404). With
+    `bandwidth` (bytes per second) set, receiving a request body also takes as long as it would
+    take to upload it at that rate.
+
+    Faults are injected by setting `fault` to a function of the request path that returns extra
+    seconds to wait before answering and a status code to fail with (or None to answer normally),
+    optionally followed by seconds to wait between each DRIP_SIZE bytes of the body.
+    """
+
+    def __init__(self, routes, delay=0.0, bandwidth=None):
+        routes = sorted(routes.items(), key=lambda route: len(route[0]), reverse=True)
+        hits = self.hits = collections.Counter()
+        stub = self
+        self.fault = None
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Without this, keep-alive responses stall on delayed ACKs and every call looks 40 ms slower
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                length = len(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                time.sleep(delay + (length / bandwidth if bandwidth else 0))
+                for prefix, body in routes:
+                    if self.path.startswith(prefix):
+                        hits[prefix] += 1
+                        drip = None
+                        if stub.fault is not None:
+                            extra_delay, status, *drip = stub.fault(self.path)
+                            time.sleep(extra_delay)
+                            if status is not None:
+                                self.send_error(status)
+                                return
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/json")
+                        self.send_header("Content-Length", str(len(body)))
+                        self.end_headers()
+                        if drip:
+                            for start in range(0, len(body), DRIP_SIZE):
+                                self.wfile.write(body[start:start + DRIP_SIZE])
+                                self.wfile.flush()
+                                time.sleep(drip[0])
+                        else:
+                            self.wfile.write(body)
+                        return
+                hits[None] += 1
+                self.send_error(404)
+
+            do_POST = do_PATCH = do_GET
+
+        self.server = StubHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@benchmark
+def bench_snapshot_load():
+    """Cold-start cost: downloading and parsing both JSON boards vs loading the packed snapshot file."""
+    for size in (1_000, 10_000):
+        softcore = make_board(size, hardcore=False)
+        hardcore = make_board(size, hardcore=True)
+        stub = StubServer({
+            "/leaderboards/scores?type=normal": json.dumps({"leaderboards": softcore}).encode(),
+            "/leaderboards/scores?type=hardcore": json.dumps({"leaderboards": hardcore}).encode(),
+        })
+        function_app.LEADERBOARD_API_URL = stub.url
+        path = os.path.join(tempfile.mkdtemp(), "snapshot.bin")
+        function_app.write_snapshot_file(function_app.LeaderboardSnapshot(to_records(softcore), to_records(hardcore)), path)
+
+        print(f"{size} characters per board (snapshot file {os.path.getsize(path) / 1024:.0f} KiB)")
+        report("JSON download + parse + index", measure(function_app.load_leaderboard_snapshot, repeat=10))
+        report("snapshot file load + index", measure(lambda: function_app.read_snapshot_file(path), repeat=10))
+        stub.close()
+
+
+@benchmark
+def bench_offhand_classifier():
+    """Offhand classification of a whole board, with a cold and a warm memo."""
+    board = to_records(make_board(10_000, hardcore=False))
+
+    def cold():
+        function_app.get_offhand_type.cache_clear()
+        function_app.classify_offhands(board)
+
+    print(f"{len(board)} characters")
+    report("classify_offhands (cold memo)", measure(cold, repeat=10))
+    report("classify_offhands (warm memo)", measure(lambda: function_app.classify_offhands(board), repeat=10))
+
+
+class OutBinding:
+    """Stands in for a func.Out output binding."""
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def signed_request(signing_key, payload):
+    body = json.dumps(payload).encode()
+    timestamp = str(int(time.time()))
+    signature = signing_key.sign(timestamp.encode() + body).signature.hex()
+    headers = {"X-Signature-Ed25519": signature, "X-Signature-Timestamp": timestamp, "Content-Type": "application/json"}
+    return func.HttpRequest("POST", "http://localhost/api/dr_discord_bot_handler", headers=headers, body=body)
+
+
+def legacy_ingress(req, public_key_hex):
+    """The old ingress path: two JSON parses, a verify key built per request and the body re-serialized for the queue."""
+    if req.get_json()["type"] == "warmup":
+        return function_app.create_http_response("Warmed up", 200)
+    VerifyKey(bytes.fromhex(public_key_hex)).verify(req.headers["X-Signature-Timestamp"].encode() + req.get_body(), bytes.fromhex(req.headers["X-Signature-Ed25519"]))
+    req_body = req.get_json()
+    if req_body["type"] == 2:
+        OutBinding().set(json.dumps(req_body))
+    return function_app.create_http_response({"type": 5, "content": "Pending"}, 200)
+
+
+@benchmark
+def bench_ingress():
+    """Signature verification and parsing in dr_discord_bot_handler, before and after the single-parse path."""
+    signing_key = SigningKey.generate()
+    public_key_hex = signing_key.verify_key.encode().hex()
+    function_app.DISCORD_VERIFY_KEY = signing_key.verify_key
+    function_app.WORK_QUEUE_BACKEND = "azure"
+    handler = function_app.dr_discord_bot_handler._function.get_user_function()
+
+    with open(FIXTURE_PATH, "r") as file:
+        resolved = {"users": {"1": {"id": "1", "username": "konmura", "global_name": "Konmura"}}, "fixture": json.load(file)[:1]}
+    command = {"type": 2, "id": "1", "application_id": "1", "token": "t" * 200, "guild_id": "1", "channel_id": "1",
+               "member": {"user": {"id": "1", "username": "konmura"}, "roles": []},
+               "data": {"id": "1", "name": "leaderboard", "type": 1, "options": [{"name": "user", "type": 3, "value": "konmura"}], "resolved": resolved}}
+    requests_ = [signed_request(signing_key, command) for _ in range(2000)]
+
+    for label, call in (
+        ("before: get_json x2 + verify_key", lambda req: legacy_ingress(req, public_key_hex)),
+        ("after: single parse + cached verifier", lambda req: handler(req, OutBinding())),
+    ):
+        samples = []
+        start = time.perf_counter()
+        for req in requests_:
+            request_start = time.perf_counter()
+            call(req)
+            samples.append(time.perf_counter() - request_start)
+        elapsed = time.perf_counter() - start
+        report(label, samples)
+        print(f"  {'':<40} {len(requests_) / elapsed:9.0f} requests/s")
+
+
+@benchmark
+def bench_work_queue(messages=200):
+    """
+    dr_discord_bot_handler through the local queue backends: every deferred interaction must reach
+    process_interaction exactly once. The SQLite queue must also hand out again what a crashed
+    consumer claimed but never acknowledged.
+    """
+    signing_key = SigningKey.generate()
+    function_app.DISCORD_VERIFY_KEY = signing_key.verify_key
+    handler = function_app.dr_discord_bot_handler._function.get_user_function()
+    requests_ = [signed_request(signing_key, {"type": 2, "id": str(i), "token": "t", "data": {"name": "rupturecalc", "options": []}})
+                 for i in range(messages)]
+
+    consumed = collections.Counter()
+    consumed_lock = threading.Lock()
+
+    def record(raw_req):
+        with consumed_lock:
+            consumed[raw_req["id"]] += 1
+
+    ok = True
+    original_process, original_backend, original_path = function_app.process_interaction, function_app.WORK_QUEUE_BACKEND, function_app.WORK_QUEUE_SQLITE_PATH
+    directory = tempfile.mkdtemp(prefix="dr_work_queue_")
+    function_app.process_interaction = record
+    try:
+        for backend in ("memory", "sqlite"):
+            consumed.clear()
+            function_app._local_work_queue = None
+            function_app.WORK_QUEUE_BACKEND = backend
+            function_app.WORK_QUEUE_SQLITE_PATH = os.path.join(directory, "queue.sqlite3")
+            start = time.perf_counter()
+            deferred = sum(json.loads(handler(req, OutBinding()).get_body())["type"] == 5 for req in requests_)
+            while sum(consumed.values()) < messages and time.perf_counter() - start < 10:
+                time.sleep(0.01)
+            # Anything handed out twice would show up shortly after the last message
+            time.sleep(0.5)
+            elapsed = time.perf_counter() - start
+            once = sum(count == 1 for count in consumed.values())
+            print(f"  {backend:<40} {once}/{messages} consumed once, {deferred} deferred, {sum(consumed.values())} deliveries in {elapsed:.2f} s")
+            ok = ok and deferred == messages and once == messages and sum(consumed.values()) == messages
+            function_app._local_work_queue.close()
+            function_app._local_work_queue = None
+
+        # A consumer that claimed a batch and died before acknowledging it
+        path = os.path.join(directory, "crash.sqlite3")
+        crashed = function_app.SQLiteWorkQueue(path, visibility_timeout=0.2)
+        for i in range(5):
+            crashed._put(str(i))
+        claimed = crashed.get_batch(5)
+        restarted = function_app.SQLiteWorkQueue(path, visibility_timeout=0.2)
+        hidden = restarted.get_batch(5, timeout=0.0)
+        time.sleep(0.3)
+        redelivered = restarted.get_batch(5, timeout=0.0)
+        restarted.ack([receipt for receipt, _ in redelivered])
+        left = restarted.get_batch(5, timeout=0.5)
+        print(f"  {'sqlite, consumer crash':<40} {len(claimed)} claimed, {len(hidden)} visible while claimed, "
+              f"{len(redelivered)} redelivered, {len(left)} left after ack")
+        ok = ok and len(claimed) == 5 and not hidden and [m for _, m in redelivered] == [m for _, m in claimed] and not left
+    finally:
+        if function_app._local_work_queue is not None:
+            function_app._local_work_queue.close()
+            function_app._local_work_queue = None
+        function_app.process_interaction, function_app.WORK_QUEUE_BACKEND = original_process, original_backend
+        function_app.WORK_QUEUE_SQLITE_PATH = original_path
+        shutil.rmtree(directory, ignore_errors=True)
+    return ok
+
+
+def load_ocr_corpus():
+    """
+    OCR.space responses, or raw tesseract output, with the item data get_item_data is expected to
+    return for them.
+    """
+    with open(OCR_CORPUS_PATH, "r") as file:
+        corpus = json.load(file)
+    for case in corpus:
+        if "tesseract_output" in case:
+            # Wrapped in the OCR.space response shape so both backends go through get_item_data
+            case["body"] = json.dumps({"ParsedResults": [{"ParsedText": function_app.tesseract_text(case["tesseract_output"])}]})
+        else:
+            # get_image_text turns the escaped line breaks of the raw response into _BREAK_
+            case["body"] = case["response"].replace("\\r\\n", "_BREAK_")
+    return corpus
+
+
+@benchmark
+def bench_item_parser():
+    """Correctness of get_item_data on the OCR corpus, and parser throughput in batch mode."""
+    corpus = load_ocr_corpus()
+    failures = [case["name"] for case in corpus if list(function_app.get_item_data(case["body"]).items()) != list(case["expected"].items())]
+    print(f"  {len(corpus) - len(failures)}/{len(corpus)} corpus responses parsed as expected" + (f", mismatches: {', '.join(failures)}" if failures else ""))
+
+    bodies = [case["body"] for case in corpus] * 1000
+    samples = measure(lambda: function_app.parse_item_batch(bodies), repeat=5)
+    report(f"parse_item_batch ({len(bodies)} responses)", samples)
+    print(f"  {'':<40} {len(bodies) / statistics.median(samples):9.0f} responses/s")
+    return not failures
+
+
+# Item screenshots are full screen captures with the tooltip somewhere on them
+SCREENSHOT_SIZE = (2560, 1440)
+# Upload rate of the OCR round trip benchmark, in bytes per second (20 Mbit/s by default)
+OCR_UPLOAD_BANDWIDTH = float(os.getenv("OCR_UPLOAD_BANDWIDTH", "2500000"))
+TOOLTIP_FONT_SIZE = 28
+TOOLTIP_PADDING = 24
+
+
+def tooltip_line_colour(index, line):
+    if index == 0:
+        return (235, 190, 80)
+    if line.startswith("+"):
+        return (120, 225, 120)
+    return (215, 215, 225)
+
+
+def make_item_screenshot(lines, rng, size=SCREENSHOT_SIZE):
+    """
+    A game-like screenshot: noisy mid-tone scenery with some dark clutter and a HUD bar, and a dark
+    item tooltip showing `lines` at a random place.
+
+    Returns:
+        tuple: The PNG bytes, the (left, top, right, bottom) box of the tooltip and an "L" mask of its text pixels.
+    """
+    width, height = size
+    # Smooth colour blotches from upscaled noise, lifted to mid tones, with fine grain on top
+    channels = [Image.effect_noise((width // 64, height // 64), 70).resize(size, Image.BICUBIC).point(lambda value: int(value * 0.6) + 70)
+                for _ in range(3)]
+    scenery = Image.blend(Image.merge("RGB", channels), Image.effect_noise(size, 80).convert("RGB"), 0.15)
+    draw = ImageDraw.Draw(scenery)
+    for _ in range(60):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(20, 300), rng.randrange(20, 300)
+        colour = tuple(rng.randrange(70, 240) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)((x, y, x + w, y + h), fill=colour)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(10, 120), rng.randrange(10, 120)
+        draw.ellipse((x, y, x + w, y + h), fill=(25, 20, 30))
+    draw.rectangle((0, height - height // 24, width, height), fill=(30, 28, 35))
+
+    font = ImageFont.load_default(size=TOOLTIP_FONT_SIZE)
+    line_height = TOOLTIP_FONT_SIZE + 8
+    text_width = max([int(draw.textlength(line, font=font)) for line in lines] + [200])
+    box_width, box_height = text_width + 2 * TOOLTIP_PADDING, len(lines) * line_height + 2 * TOOLTIP_PADDING
+    left, top = rng.randrange(0, width - box_width), rng.randrange(0, height - height // 24 - box_height)
+    box = (left, top, left + box_width, top + box_height)
+    panel = Image.blend(Image.new("RGB", (box_width, box_height), (18, 16, 24)), Image.effect_noise((box_width, box_height), 40).convert("RGB"), 0.1)
+    scenery.paste(panel, box[:2])
+    draw.rectangle(box, outline=(160, 130, 60), width=3)
+
+    mask = Image.new("L", size)
+    mask_draw = ImageDraw.Draw(mask)
+    for index, line in enumerate(lines):
+        position = (left + TOOLTIP_PADDING, top + TOOLTIP_PADDING + index * line_height)
+        draw.text(position, line, font=font, fill=tooltip_line_colour(index, line))
+        mask_draw.text(position, line, font=font, fill=255)
+
+    output = io.BytesIO()
+    scenery.save(output, "PNG")
+    return output.getvalue(), box, mask
+
+
+def glyph_iou(preprocessed, mask, found, box):
+    """
+    Overlap of the black pixels of a preprocessed image with the text mask, cropped (to `found`)
+    and scaled the same way, inside the tooltip `box`; the margin of the crop is scenery.
+    """
+    found = found or (0, 0) + mask.size
+    scale = preprocessed.width / (found[2] - found[0])
+    panel = tuple(round((edge - origin) * scale) for edge, origin in zip(box, found[:2] * 2))
+    truth = mask.crop(found).resize(preprocessed.size, Image.BILINEAR).crop(panel).point(lambda value: 255 if value > 127 else 0, "1")
+    text = ImageChops.invert(preprocessed.convert("L")).crop(panel).convert("1")
+    overlap = ImageChops.logical_and(truth, text).histogram()[255]
+    union = ImageChops.logical_or(truth, text).histogram()[255]
+    return overlap / union if union else 1.0
+
+
+def fields_right(backend, image_bytes, expected):
+    """Reads an image as it is with an OCR backend and returns how many of the `expected` item fields parse_item_text gets right."""
+    item = function_app.parse_item_text(backend.read_text(None, image_bytes, image_bytes)).to_display_dict()
+    return sum(item.get(field) == value for field, value in expected.items())
+
+
+def make_screenshot_fixtures():
+    """
+    One synthetic screenshot per recorded OCR.space response in the corpus, showing its text.
+
+    Returns:
+        list: (case, PNG bytes, tooltip box, text mask, the item fields the text parses to) tuples.
+    """
+    rng = random.Random(23)
+    fixtures = []
+    for case in load_ocr_corpus():
+        if "response" not in case:
+            continue
+        parsed_text = json.loads(case["response"])["ParsedResults"][0]["ParsedText"]
+        raw, box, mask = make_item_screenshot(parsed_text.rstrip("\r\n").split("\r\n"), rng)
+        fixtures.append((case, raw, box, mask, function_app.parse_item_text(parsed_text.replace("\r\n", "_BREAK_")).to_display_dict()))
+    return fixtures
+
+
+@benchmark
+def bench_ocr_preprocess():
+    """
+    Preprocessing of synthetic 2560x1440 item screenshots (one per OCR corpus case): time, payload
+    size and the upload part of the OCR round trip at OCR_UPLOAD_BANDWIDTH, raw screenshot versus
+    preprocessed. The stub OCR answers instantly, so the round trip only models the transfer.
+    Whether the crop holds the whole tooltip and the text survives binarization is checked against
+    the rendered text; parsed field accuracy needs tesseract on PATH and is skipped without it.
+    """
+    cases = make_screenshot_fixtures()
+    preprocess_samples = []
+    failures = []
+    ious = []
+    preprocessed = []
+    for case, raw, box, mask, _ in cases:
+        start = time.perf_counter()
+        image_bytes = function_app.preprocess_item_image(raw)
+        preprocess_samples.append(time.perf_counter() - start)
+        preprocessed.append(image_bytes)
+        found = function_app.find_tooltip_box(Image.open(io.BytesIO(raw)).convert("L"))
+        if found is None or not (found[0] <= box[0] and found[1] <= box[1] and found[2] >= box[2] and found[3] >= box[3]):
+            failures.append(case["name"])
+        ious.append(glyph_iou(Image.open(io.BytesIO(image_bytes)), mask, found, box))
+
+    raw_sizes = [len(raw) for _, raw, _, _, _ in cases]
+    sizes = [len(image_bytes) for image_bytes in preprocessed]
+    report("preprocess_item_image", preprocess_samples)
+    print(f"  {'payload, raw screenshot':<40} {statistics.median(raw_sizes) / 1024:9.0f} KiB median")
+    print(f"  {'payload, preprocessed':<40} {statistics.median(sizes) / 1024:9.1f} KiB median "
+          f"({statistics.median(raw / size for raw, size in zip(raw_sizes, sizes)):.0f}x smaller)")
+    print(f"  crop holds the tooltip in {len(cases) - len(failures)}/{len(cases)} screenshots" + (f", missed: {', '.join(failures)}" if failures else ""))
+    print(f"  glyph IoU against the rendered text: min {min(ious):.2f}, median {statistics.median(ious):.2f}")
+
+    stub = StubServer({"/parse/image": cases[0][0]["response"].encode()}, bandwidth=OCR_UPLOAD_BANDWIDTH)
+    function_app.OCR_API_URL = f"{stub.url}/parse/image"
+    try:
+        report(f"OCR upload, raw ({OCR_UPLOAD_BANDWIDTH * 8 / 1e6:.0f} Mbit/s)",
+               [min(measure(lambda: function_app.get_image_text(None, raw), repeat=2)) for _, raw, _, _, _ in cases])
+        report(f"OCR preprocess + upload ({OCR_UPLOAD_BANDWIDTH * 8 / 1e6:.0f} Mbit/s)",
+               [elapsed + min(measure(lambda: function_app.get_image_text(None, image_bytes), repeat=2))
+                for elapsed, image_bytes in zip(preprocess_samples, preprocessed)])
+    finally:
+        stub.close()
+
+    if shutil.which(function_app.TESSERACT_COMMAND):
+        tesseract = function_app.TesseractBackend(function_app.TESSERACT_COMMAND, 1, function_app.OCR_TIMEOUT)
+        total = sum(len(expected) for *_, expected in cases)
+        raw_correct = sum(fields_right(tesseract, raw, expected) for _, raw, _, _, expected in cases)
+        correct = sum(fields_right(tesseract, image_bytes, expected) for image_bytes, (*_, expected) in zip(preprocessed, cases))
+        print(f"  parsed fields right with tesseract: raw {raw_correct}/{total}, preprocessed {correct}/{total}")
+    else:
+        print("  tesseract not found, parsed field accuracy skipped")
+    return not failures
+
+
+@benchmark
+def bench_ocr_backends():
+    """
+    The OCR backends side by side on the preprocessed screenshot fixtures: latency per screenshot
+    and the item fields parsed right. OCR.space is a stub that answers with the recorded response
+    of each case after its recorded processing time, on top of the upload at OCR_UPLOAD_BANDWIDTH,
+    so its accuracy is that of the recordings. Tesseract runs for real when it is on PATH. Turning
+    preprocessing on or off must not serve OCR results read with the other setting.
+    """
+    cases = [(case, function_app.preprocess_item_image(raw), expected) for case, raw, _, _, expected in make_screenshot_fixtures()]
+    total = sum(len(expected) for *_, expected in cases)
+
+    processing = {case["name"]: float(json.loads(case["response"])["ProcessingTimeInMilliseconds"]) / 1000 for case, _, _ in cases}
+    stub = StubServer({f"/parse/{case['name']}": case["response"].encode() for case, _, _ in cases}, bandwidth=OCR_UPLOAD_BANDWIDTH)
+    stub.fault = lambda path: (processing[path.rsplit("/", 1)[1]], None)
+    backends = [function_app.OcrSpaceBackend()]
+    if shutil.which(function_app.TESSERACT_COMMAND):
+        backends.append(function_app.TesseractBackend(function_app.TESSERACT_COMMAND, function_app.TESSERACT_WORKERS, function_app.OCR_TIMEOUT))
+    try:
+        for backend in backends:
+            samples = []
+            correct = 0
+            for case, image_bytes, expected in cases:
+                function_app.OCR_API_URL = f"{stub.url}/parse/{case['name']}"
+                start = time.perf_counter()
+                correct += fields_right(backend, image_bytes, expected)
+                samples.append(time.perf_counter() - start)
+            report(f"{backend.name}", samples)
+            print(f"  {'':<40} {correct}/{total} item fields parsed right")
+    finally:
+        stub.close()
+    if len(backends) == 1:
+        print(f"  {function_app.TESSERACT_COMMAND} not found, tesseract backend skipped")
+
+    # Results read with other OCR settings must not be served after the settings change
+    stub = start_upstream_stubs(board_size=10)
+    preprocess = function_app.OCR_PREPROCESS
+    attachment_url = f"{stub.url}/attachments/item.png"
+    calls = []
+    try:
+        clear_caches()
+        for setting in (False, False, True, True, False):
+            function_app.OCR_PREPROCESS = setting
+            function_app.read_item_image(attachment_url)
+            calls.append(stub.hits["/parse/image"])
+    finally:
+        function_app.OCR_PREPROCESS = preprocess
+        stub.close()
+    passed = calls == [1, 1, 2, 2, 2]
+    print(f"  OCR cache per setting: {'ok' if passed else 'FAIL'}, OCR requests after each read {calls}")
+    return passed
+
+
+def make_rupture_sheet():
+    rows = [["Rupture Level", "Chests", "Gold", "CraftMat Avg", "Essence", "Time Essence", "Runtime", "Notes"]]
+    for level in range(36, 501):
+        rows.append([str(level), "1", str(level * 40), str(level * 3), str(level), str(max(1, level // 10)), "90", ""])
+    return {"values": rows}
+
+
+def start_upstream_stubs(board_size=5_000, delay=0.0):
+    """
+    Starts one stub server standing in for the leaderboard API, the Sheets API, OCR.space, the
+    Discord API and the attachment CDN, and points function_app at it.
+    """
+    ocr_response = load_ocr_corpus()[0]["response"]
+    stub = StubServer({
+        "/leaderboards/scores?type=normal": json.dumps({"leaderboards": make_board(board_size, hardcore=False)}).encode(),
+        "/leaderboards/scores?type=hardcore": json.dumps({"leaderboards": make_board(board_size, hardcore=True)}).encode(),
+        "/v4/spreadsheets/": json.dumps(make_rupture_sheet()).encode(),
+        "/parse/image": ocr_response.encode(),
+        "/webhooks/": b"{}",
+        "/attachments/": make_item_screenshot(["Stub Item", "Item Level: 1"], random.Random(0), size=(640, 360))[0],
+    }, delay=delay)
+    function_app.LEADERBOARD_API_URL = stub.url
+    function_app.SHEETS_API_URL = stub.url
+    function_app.OCR_API_URL = f"{stub.url}/parse/image"
+    function_app.discord_dispatcher.base_url = stub.url
+    function_app.ocr_cache.directory = tempfile.mkdtemp()
+    return stub
+
+
+def clear_caches():
+    function_app.leaderboard_cache.clear()
+    function_app.rupture_table_cache.clear()
+    function_app.ocr_cache.clear()
+    function_app.interaction_results.clear()
+
+
+def load_interactions(stub_url):
+    """Recorded interaction payloads, with attachment URLs pointed at the stub server."""
+    with open(INTERACTIONS_PATH, "r") as file:
+        interactions = json.load(file)
+    for case in interactions:
+        for attachment in case["interaction"]["data"].get("resolved", {}).get("attachments", {}).values():
+            attachment["url"] = f"{stub_url}/attachments/{attachment['id']}/{attachment['filename']}"
+    return interactions
+
+
+@benchmark
+def bench_interactions(repeat=50):
+    """
+    Replays test_interactions.json end to end (interact() plus the Discord follow-up) against local
+    stubs, with cold caches (every upstream fetched) and warm caches. Reports latency percentiles per
+    command and the peak memory allocated by one warm call.
+    """
+    stub = start_upstream_stubs()
+    function_app.leaderboard_cache.seed = None
+    interactions = load_interactions(stub.url)
+
+    with open(COMMANDS_PATH, "r") as file:
+        defined = {command["name"] for command in yaml.safe_load(file)}
+    missing = defined - {case["interaction"]["data"]["name"] for case in interactions}
+    if missing:
+        print(f"  no recorded payloads for: {', '.join(sorted(missing))}")
+
+    for mode in ("cold", "warm"):
+        print(f"  -- {mode} caches --")
+        for case in interactions:
+            def run():
+                if mode == "cold":
+                    clear_caches()
+                function_app.process_interaction(case["interaction"])
+
+            run()
+            samples = measure(run, repeat=repeat)
+
+            extra = ""
+            if mode == "warm":
+                tracemalloc.start()
+                tracemalloc.reset_peak()
+                function_app.process_interaction(case["interaction"])
+                extra = f"   peak alloc {tracemalloc.get_traced_memory()[1] / 1024:8.1f} KiB"
+                tracemalloc.stop()
+            report(case["name"], samples, extra)
+    stub.close()
+
+
+@benchmark
+def bench_result_cache(repeat=200):
+    """interact() against a result cache hit for every cacheable recorded interaction, with warm data caches."""
+    stub = start_upstream_stubs()
+    function_app.leaderboard_cache.seed = None
+    clear_caches()
+    for case in load_interactions(stub.url):
+        if function_app.interaction_result_key(case["interaction"]["data"]) is None:
+            function_app.interact(case["interaction"])  # warms the data caches
+        if function_app.interaction_result_key(case["interaction"]["data"]) is None:
+            continue
+        function_app.cached_interact(case["interaction"])
+        uncached = measure(lambda: function_app.interact(case["interaction"]), repeat=repeat)
+        cached = measure(lambda: function_app.cached_interact(case["interaction"]), repeat=repeat)
+        print(f"  {case['name']:<40} interact p50 {statistics.median(uncached) * 1e6:9.1f} us   "
+              f"cache hit p50 {statistics.median(cached) * 1e6:7.1f} us")
+    print(f"  hits {function_app.interaction_results.hits}, misses {function_app.interaction_results.misses}")
+
+    # A transient error must be answered once, not replayed from the cache until the data changes
+    case = next(case for case in load_interactions(stub.url) if case["name"] == "rupturecalc 300")
+    function_app.interaction_results.clear()
+    plan = function_app.RuptureTable.plan
+    function_app.RuptureTable.plan = lambda *args: 1 / 0
+    logging.disable(logging.CRITICAL)
+    try:
+        failed = function_app.cached_interact(case["interaction"])
+    finally:
+        function_app.RuptureTable.plan = plan
+        logging.disable(logging.NOTSET)
+    retried = function_app.cached_interact(case["interaction"])
+    passed = failed.startswith("Error") and not retried.startswith("Error")
+    print(f"  error replies kept out of the cache: {'ok' if passed else 'FAIL, replayed ' + repr(retried)}")
+    stub.close()
+    return passed
+
+
+class DiscordCommandsStub:
+    """
+    Stands in for Discord's application commands endpoint: GET lists, PUT overwrites, POST adds and
+    DELETE removes commands, answering with the extra fields Discord adds. Counts requests per method.
+    """
+
+    def __init__(self, commands):
+        stub = self
+        self.requests = collections.Counter()
+        self.commands = [self.as_live(command, position) for position, command in enumerate(commands)]
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                stub.requests[self.command] += 1
+                self.respond(200, stub.commands)
+
+            def do_PUT(self):
+                stub.requests[self.command] += 1
+                commands = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.commands = [stub.as_live(command, position) for position, command in enumerate(commands)]
+                self.respond(200, stub.commands)
+
+            def do_POST(self):
+                stub.requests[self.command] += 1
+                command = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.commands = [live for live in stub.commands if live["name"] != command["name"]]
+                stub.commands.append(stub.as_live(command, len(stub.commands)))
+                self.respond(201, stub.commands[-1])
+
+            def do_DELETE(self):
+                stub.requests[self.command] += 1
+                command_id = self.path.rsplit("/", 1)[1]
+                stub.commands = [live for live in stub.commands if live["id"] != command_id]
+                self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/applications/1/commands"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def as_live(command, position):
+        live = copy.deepcopy(command)
+        for option in live.get("options", []):
+            if not option.get("required"):
+                option.pop("required", None)
+        live.update({"id": str(1230000000000000000 + position), "application_id": "1", "version": "1", "type": 1,
+                     "default_member_permissions": None, "dm_permission": True, "nsfw": False, "integration_types": [0]})
+        return live
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def legacy_command_sync(defined_commands, url):
+    """The old register_commands flow: delete every stale command, then post every defined one, one request each."""
+    live = requests.get(url).json()
+    defined_names = {command["name"] for command in defined_commands}
+    for command in live:
+        if command["name"] not in defined_names:
+            requests.delete(f"{url}/{command['id']}")
+    for command in defined_commands:
+        requests.post(url, json=command)
+
+
+@benchmark
+def bench_command_sync():
+    """register_commands against a stub of the applications API: requests and time per deploy, drifted and unchanged."""
+    with open(COMMANDS_PATH, "r") as file:
+        defined = yaml.safe_load(file)
+    drifted = copy.deepcopy(defined[:-1]) + [{"name": "github", "description": "The url for the github repository."}]
+    drifted[0]["description"] = "An outdated description."
+
+    for label, sync in (("legacy delete + post", lambda: legacy_command_sync(defined, stub.url)),
+                        ("sync_commands", lambda: register_commands.sync_commands(defined))):
+        stub = DiscordCommandsStub(drifted)
+        register_commands.URL = stub.url
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            sync()
+            drifted_seconds = time.perf_counter() - start
+            drifted_requests = sum(stub.requests.values())
+            stub.requests.clear()
+            start = time.perf_counter()
+            sync()
+            unchanged_seconds = time.perf_counter() - start
+        print(f"  {label:<24} drifted: {drifted_requests:3d} requests {drifted_seconds * 1000:7.2f} ms   "
+              f"unchanged: {sum(stub.requests.values()):3d} requests {unchanged_seconds * 1000:7.2f} ms")
+        in_sync = register_commands.normalize_commands(stub.commands) == register_commands.normalize_commands(defined)
+        stub.close()
+        if not in_sync:
+            print(f"  {label} left the live commands out of sync")
+            return False
+
+    stub = DiscordCommandsStub(drifted)
+    register_commands.URL = stub.url
+    print("  dry run output:")
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        register_commands.sync_commands(defined, dry_run=True)
+    print("\n".join(f"    {line}" for line in output.getvalue().splitlines()))
+    writes = sum(count for method, count in stub.requests.items() if method != "GET")
+    stub.close()
+    return writes == 0
+
+
+class DiscordWebhookStub:
+    """
+    Stands in for Discord's interaction webhooks. Answers each request with the next scripted
+    (status, headers, payload) response, or 200 once the script runs out, and records every call
+    as (monotonic time, method, path, message content).
+    """
+
+    def __init__(self, script=()):
+        stub = self
+        self.reset(script)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_PATCH(self):
+                content = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}").get("content")
+                stub.calls.append((time.monotonic(), self.command, self.path, content))
+                status, headers, payload = stub.script.popleft() if stub.script else (200, {}, {})
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = do_PATCH
+
+        self.server = StubHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reset(self, script=()):
+        self.script = collections.deque(script)
+        self.calls = []
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def rate_limit_headers(bucket, remaining, reset_after):
+    return {"X-RateLimit-Bucket": bucket, "X-RateLimit-Remaining": str(remaining), "X-RateLimit-Reset-After": str(reset_after)}
+
+
+@benchmark
+def bench_discord_dispatch():
+    """
+    DiscordDispatcher against a scripted webhook stub: a 429 is retried after its retry_after, 5xx
+    responses back off, an exhausted bucket makes the next request wait for its reset (or fail
+    when that would pass the deadline), long replies are split over several messages, and buckets
+    of past interactions are forgotten.
+    """
+    results = []
+    # One stub for every case: a pooled connection to a closed stub whose port is reused would fail and be retried
+    stub = DiscordWebhookStub()
+
+    def check(label, passed, seconds, detail=""):
+        results.append(passed)
+        print(f"  {label:<44} {'ok  ' if passed else 'FAIL'} {seconds * 1000:8.1f} ms   {detail}")
+
+    def run(script, send):
+        stub.reset(script)
+        dispatcher = function_app.DiscordDispatcher(stub.url, prune_interval=0.2)
+        start = time.perf_counter()
+        try:
+            outcome = send(dispatcher)
+        except function_app.DiscordDeadlineExceeded as e:
+            outcome = e
+        return outcome, time.perf_counter() - start, stub.calls, dispatcher
+
+    def patch(dispatcher, webhook="/webhooks/1/token", deadline=30.0):
+        return dispatcher.request("PATCH", f"PATCH {webhook}", f"{webhook}/messages/@original", time.monotonic() + deadline, json={"content": "hi"})
+
+    logging.disable(logging.CRITICAL)
+    try:
+        response, seconds, calls, _ = run([(429, {}, {"retry_after": 0.2, "global": False})], patch)
+        check("429 retried after retry_after", response.status_code == 200 and len(calls) == 2 and calls[1][0] - calls[0][0] >= 0.2,
+              seconds, f"{len(calls)} requests")
+
+        response, seconds, calls, _ = run([(503, {}, {}), (502, {}, {})], patch)
+        gaps = [later[0] - earlier[0] for earlier, later in zip(calls, calls[1:])]
+        check("5xx retried with backoff", response.status_code == 200 and len(calls) == 3 and gaps[0] >= 0.5 and gaps[1] >= 1.0,
+              seconds, "gaps " + ", ".join(f"{gap:.2f}s" for gap in gaps))
+
+        _, seconds, calls, _ = run([(200, rate_limit_headers("b1", 0, 0.3), {})], lambda dispatcher: (patch(dispatcher), patch(dispatcher)))
+        check("exhausted bucket waits for its reset", len(calls) == 2 and calls[1][0] - calls[0][0] >= 0.3,
+              seconds, f"waited {calls[1][0] - calls[0][0]:.2f}s")
+
+        outcome, seconds, calls, _ = run([(200, rate_limit_headers("b1", 0, 5.0), {})], lambda dispatcher: (patch(dispatcher), patch(dispatcher, deadline=1.0)))
+        check("reset past the deadline fails fast", isinstance(outcome, function_app.DiscordDeadlineExceeded) and len(calls) == 1 and seconds < 0.5, seconds)
+
+        content = "\n".join(f"line {n}: " + "x" * 60 for n in range(80))
+        stub.reset()
+        dispatcher, function_app.discord_dispatcher = function_app.discord_dispatcher, function_app.DiscordDispatcher(stub.url)
+        start = time.perf_counter()
+        try:
+            function_app.send_discord_followup({"id": str(int(time.time() * 1000 - function_app.DISCORD_EPOCH_MS) << 22), "application_id": "1", "token": "t"}, content)
+        finally:
+            function_app.discord_dispatcher = dispatcher
+        parts = [call[3] for call in stub.calls]
+        check(f"{len(content)} characters split", [call[1] for call in stub.calls] == ["PATCH"] + ["POST"] * (len(parts) - 1)
+              and all(len(part) <= function_app.DISCORD_MESSAGE_LIMIT for part in parts) and "\n".join(parts) == content,
+              time.perf_counter() - start, f"{len(parts)} messages of {', '.join(str(len(part)) for part in parts)} characters")
+
+        table = "Heading\n```ansi\n" + "\n".join(f"{n:>4} | " + "y" * 50 for n in range(120)) + "\n```\nSummary line"
+        start = time.perf_counter()
+        parts = function_app.split_message(table)
+        # Apart from the fences the splitter added, the parts hold the original lines in order
+        strip_fences = lambda text: [line for line in text.split("\n") if line not in ("```", "```ansi")]
+        check(f"{len(table)} character code block split", len(parts) > 1 and sum(map(strip_fences, parts), []) == strip_fences(table)
+              and all(len(part) <= function_app.DISCORD_MESSAGE_LIMIT and part.count("```") % 2 == 0 for part in parts)
+              and all(part.startswith("```ansi\n") for part in parts[1:]),
+              time.perf_counter() - start, f"{len(parts)} messages, each with its code block closed")
+
+        script = [(200, rate_limit_headers(f"b{n}", 4, 0.1), {}) for n in range(200)]
+        _, seconds, calls, dispatcher = run(script, lambda dispatcher: [patch(dispatcher, f"/webhooks/1/token{n}") for n in range(200)] + [time.sleep(0.3), patch(dispatcher)])
+        check("buckets of past interactions forgotten", len(dispatcher._route_buckets) <= 1 and len(dispatcher._buckets) <= 1,
+              seconds, f"{len(dispatcher._route_buckets)} routes, {len(dispatcher._buckets)} buckets left after {len(calls)} interactions")
+    finally:
+        logging.disable(logging.NOTSET)
+        stub.close()
+    return all(results)
+
+
+def call_concurrently(callers, function):
+    """Starts `callers` threads that call `function` at the same moment; returns the wall time until all finished."""
+    barrier = threading.Barrier(callers)
+
+    def run():
+        barrier.wait()
+        try:
+            function()
+        except Exception:
+            pass
+
+    threads = [threading.Thread(target=run) for _ in range(callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+@benchmark
+def bench_single_flight(callers=32):
+    """
+    Concurrent callers asking for the same leaderboard, rupture sheet or OCR result against a slow
+    stub must cause exactly one upstream request each, also when the upstream fails.
+    """
+    stub = start_upstream_stubs(delay=0.05)
+    function_app.leaderboard_cache.seed = None
+    attachment_url = f"{stub.url}/attachments/1/item.png"
+    sheets_url = function_app.SHEETS_API_URL
+    ok = True
+    for label, function, prefixes, failing in (
+        ("get_user_characters", lambda: function_app.get_user_characters("player7"), ["/leaderboards/scores?type=normal", "/leaderboards/scores?type=hardcore"], False),
+        ("rupturecalc", lambda: function_app.rupturecalc(150, 1500), ["/v4/spreadsheets/"], False),
+        ("rupturecalc, failing upstream", lambda: function_app.rupturecalc(150, 1500), [None], True),
+        ("read_item_image", lambda: function_app.read_item_image(attachment_url), ["/parse/image"], False),
+    ):
+        clear_caches()
+        function_app.SHEETS_API_URL = f"{stub.url}/missing" if failing else sheets_url
+        stub.hits.clear()
+        seconds = call_concurrently(callers, function)
+        upstream_calls = [stub.hits[prefix] for prefix in prefixes]
+        ok = ok and all(count == 1 for count in upstream_calls)
+        print(f"  {label:<40} {callers} callers -> {'/'.join(map(str, upstream_calls))} upstream call(s) in {seconds * 1000:7.1f} ms")
+    function_app.SHEETS_API_URL = sheets_url
+    stub.close()
+    return ok
+
+
+@benchmark
+def bench_leaderboard_latency(repeat=20):
+    """
+    End-to-end cold /leaderboard (both boards fetched, reply sent) against stubs answering after
+    20 and 80 ms: sequential fetches over a new connection per call, then over the pooled session,
+    then with the boards fetched concurrently. Decoding holds the GIL, so only the waiting overlaps.
+    """
+    get_http_session = function_app.get_http_session
+
+    def sequential():
+        return function_app.LeaderboardSnapshot(function_app.fetch_leaderboard("normal"), function_app.fetch_leaderboard("hardcore"))
+
+    for delay in (0.02, 0.08):
+        stub = start_upstream_stubs(board_size=2_000, delay=delay)
+        function_app.leaderboard_cache.seed = None
+        case = next(case for case in load_interactions(stub.url) if case["name"] == "leaderboard player7")
+        print(f"  -- upstream latency {delay * 1000:.0f} ms --")
+        for label, session, loader in (
+            ("sequential, connection per call", lambda: requests, sequential),
+            ("sequential, pooled session", get_http_session, sequential),
+            ("concurrent, pooled session", get_http_session, function_app.load_leaderboard_snapshot),
+        ):
+            function_app.get_http_session = session
+            function_app.leaderboard_cache.loader = loader
+
+            def run():
+                clear_caches()
+                function_app.process_interaction(case["interaction"])
+
+            run()
+            report(label, measure(run, repeat=repeat))
+        function_app.get_http_session = get_http_session
+        function_app.leaderboard_cache.loader = function_app.load_leaderboard_snapshot
+        stub.close()
+
+
+def wait_for_refresh(cache, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while cache._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+# Readers of a cache being refreshed must not wait on the loader; anything slower than this did
+STALE_READ_BUDGET = 0.05
+
+
+@benchmark
+def bench_stale_refresh(load_seconds=1.0):
+    """
+    A SnapshotCache with a slow loader: while a background refresh runs, stale reads must still be
+    served at once, and a caller past `max_stale` waits for that same refresh instead of a second load.
+    """
+    loads = []
+
+    def slow_loader():
+        loads.append(time.monotonic())
+        time.sleep(load_seconds)
+        return len(loads)
+
+    cache = function_app.SnapshotCache("slow", slow_loader, ttl=60, max_stale=3600)
+    cache.put(0)
+    cache._fetched_at -= 120
+    results = []
+    for label, read in (("get, starts the refresh", cache.get), ("get, refresh in flight", cache.get),
+                        ("get_nowait", cache.get_nowait), ("current_version", cache.current_version)):
+        start = time.perf_counter()
+        value = read()
+        seconds = time.perf_counter() - start
+        passed = seconds < STALE_READ_BUDGET and value is not None
+        results.append(passed)
+        print(f"  {label:<44} {'ok  ' if passed else 'FAIL'} {seconds * 1000:8.1f} ms")
+    wait_for_refresh(cache)
+    passed = cache.get() == 1 and len(loads) == 1
+    results.append(passed)
+    print(f"  {'refreshed value served afterwards':<44} {'ok  ' if passed else 'FAIL'} {len(loads)} load(s)")
+
+    cache._fetched_at -= 7200
+    cache.get_nowait()
+    start = time.perf_counter()
+    value = cache.get()
+    seconds = time.perf_counter() - start
+    passed = value == 2 and len(loads) == 2
+    results.append(passed)
+    print(f"  {'get past max_stale joins the refresh':<44} {'ok  ' if passed else 'FAIL'} {seconds * 1000:8.1f} ms   {len(loads)} load(s)")
+    return all(results)
+
+
+@benchmark
+def bench_upstream_faults():
+    """
+    Injects faults into the stubbed leaderboard and Sheets APIs: a hung API must time out, one that
+    trickles its body must be cut off at the call's deadline, repeated
+    failures must open the circuit so calls fail fast, the circuit must close again once the API
+    recovers, replies must fall back to the last good data marked as stale, and a slow GET must be
+    answered by its hedged request.
+    """
+    stub = start_upstream_stubs(board_size=1_000)
+    function_app.leaderboard_cache.seed = None
+    case = next(case for case in load_interactions(stub.url) if case["name"] == "leaderboard player7")
+    upstreams = function_app.leaderboard_upstream, function_app.sheets_upstream
+    function_app.leaderboard_upstream = function_app.Upstream("leaderboard API", 0.3, 1.0, failure_threshold=3, reset_after=0.5)
+    function_app.sheets_upstream = function_app.Upstream("Sheets API", 2.0, 5.0, hedge_after=0.05)
+    leaderboard = "/leaderboards/"
+    results = []
+
+    def check(label, passed, seconds, detail=""):
+        results.append(passed)
+        print(f"  {label:<44} {'ok  ' if passed else 'FAIL'} {seconds * 1000:8.1f} ms   {detail}")
+
+    logging.disable(logging.CRITICAL)
+    try:
+        clear_caches()
+        stub.fault = lambda path: (5.0, None) if path.startswith(leaderboard) else (0.0, None)
+        start = time.perf_counter()
+        message = function_app.leaderboard_command({"user": "player7"})
+        seconds = time.perf_counter() - start
+        check("hung leaderboard API times out", message == "Failed to retrieve leaderboard data." and seconds < 1.0, seconds)
+
+        # Every read gets data well within the read timeout, but the body would take minutes
+        clear_caches()
+        stub.fault = lambda path: (0.0, None, 0.05) if path.startswith(leaderboard) else (0.0, None)
+        start = time.perf_counter()
+        message = function_app.leaderboard_command({"user": "player7"})
+        seconds = time.perf_counter() - start
+        deadline = function_app.leaderboard_upstream.deadline
+        check("slow drip stopped at the deadline", message == "Failed to retrieve leaderboard data." and deadline <= seconds < deadline + 0.5, seconds)
+
+        stub.fault = lambda path: (0.0, 500) if path.startswith(leaderboard) else (0.0, None)
+        function_app.leaderboard_cache.clear()
+        function_app.leaderboard_cache.get()
+        calls = sum(stub.hits[prefix] for prefix in stub.hits if prefix and prefix.startswith(leaderboard))
+        samples = []
+        for _ in range(20):
+            function_app.leaderboard_cache.clear()
+            start = time.perf_counter()
+            function_app.leaderboard_cache.get()
+            samples.append(time.perf_counter() - start)
+        after = sum(stub.hits[prefix] for prefix in stub.hits if prefix and prefix.startswith(leaderboard))
+        check("open circuit fails fast", after == calls and max(samples) < 0.005, statistics.median(samples), f"{after - calls} upstream calls in 20 refreshes")
+
+        stub.fault = None
+        # A board fetch still running on the fetch pool may record its failure a little later
+        time.sleep(function_app.leaderboard_upstream.reset_after + 0.1)
+        start = time.perf_counter()
+        snapshot = function_app.leaderboard_cache.get()
+        check("circuit closes once the API recovers", snapshot is not None and function_app.leaderboard_upstream._opened_at is None, time.perf_counter() - start)
+
+        stub.fault = lambda path: (0.0, 500) if path.startswith(leaderboard) else (0.0, None)
+        for label, age in (("stale fallback, refreshed in background", function_app.LEADERBOARD_CACHE_TTL + 1),
+                           ("stale fallback, past max stale", function_app.LEADERBOARD_CACHE_MAX_STALE + 1)):
+            function_app.leaderboard_cache._fetched_at = time.monotonic() - age
+            function_app.interaction_results.clear()
+            function_app.cached_interact(case["interaction"])
+            wait_for_refresh(function_app.leaderboard_cache)
+            start = time.perf_counter()
+            message = function_app.cached_interact(case["interaction"])
+            check(label, "Player7" in message and "could not be refreshed" in message, time.perf_counter() - start, message.splitlines()[-1])
+
+        sheet_requests = []
+
+        def slow_first_sheet_request(path):
+            if path.startswith("/v4/spreadsheets/"):
+                sheet_requests.append(path)
+                if len(sheet_requests) == 1:
+                    return 1.0, None
+            return 0.0, None
+
+        stub.fault = slow_first_sheet_request
+        function_app.rupture_table_cache.clear()
+        sheet_calls = stub.hits["/v4/spreadsheets/"]
+        start = time.perf_counter()
+        message = function_app.rupturecalc(150, 1500)
+        seconds = time.perf_counter() - start
+        check("slow Sheets GET answered by the hedge", "Rupture" in message and seconds < 0.5, seconds, f"{stub.hits['/v4/spreadsheets/'] - sheet_calls} upstream calls")
+    finally:
+        logging.disable(logging.NOTSET)
+        stub.fault = None
+        function_app.leaderboard_upstream, function_app.sheets_upstream = upstreams
+        stub.close()
+    return all(results)
+
+
+def evolve_board(board, seed=0):
+    """Returns the next refresh of `board`: some characters gain rupture levels, some hardcore characters die, and it is re-sorted."""
+    rng = random.Random(seed)
+    evolved = []
+    for character_info in board:
+        character_info = dict(character_info)
+        if rng.random() < 0.05:
+            character_info["raptureLevel"] = str(int(character_info["raptureLevel"]) + rng.randint(1, 5))
+        if character_info["isHardcore"] and character_info["deaths"] == "0" and rng.random() < 0.01:
+            character_info["deaths"] = "1"
+        evolved.append(character_info)
+    evolved.sort(key=lambda character_info: int(character_info["raptureLevel"]), reverse=True)
+    return evolved
+
+
+@benchmark
+def bench_leaderboard_diff():
+    """
+    Diffing consecutive snapshots for the change feed, and what the feed keeps of them: the posted
+    summary must come out the same from the kept changes, nothing may pile up for posting on an
+    instance that does not post, and every player who moved must find their change.
+    """
+    results = []
+    for size in (10_000, 50_000):
+        softcore, hardcore = make_board(size, hardcore=False), make_board(size, hardcore=True)
+        previous = function_app.LeaderboardSnapshot(to_records(softcore), to_records(hardcore))
+        current = function_app.LeaderboardSnapshot(to_records(evolve_board(softcore, 1)), to_records(evolve_board(hardcore, 2)))
+        changes = function_app.diff_leaderboards(previous, current)
+        kinds = collections.Counter(change.kind for change in changes)
+        print(f"{size} characters per board: {dict(kinds)}")
+        report("diff_leaderboards", measure(lambda: function_app.diff_leaderboards(previous, current), repeat=10))
+
+        feed = function_app.LeaderboardChangeFeed()
+        posting_feed = function_app.LeaderboardChangeFeed(collect_unposted=True)
+        for _ in range(feed.diffs.maxlen + 5):
+            feed.on_refresh(previous, current)
+            posting_feed.on_refresh(previous, current)
+        kept = sum(len(diff) for _, diff in feed.diffs)
+        same_summary = function_app.format_leaderboard_changes(posting_feed.take_unposted()) == function_app.format_leaderboard_changes(changes)
+        passed = same_summary and not feed.unposted and kept <= feed.diffs.maxlen * 3 * feed.per_kind
+        results.append(passed)
+        print(f"  {'feed after ' + str(feed.diffs.maxlen + 5) + ' refreshes':<40} {'ok  ' if passed else 'FAIL'} {kept} changes kept "
+              f"(a full diff is {len(changes)}), summary {'unchanged' if same_summary else 'CHANGED'}")
+
+        # Any player who moved must find their own change, not only the ones big enough for the summary
+        sample = random.Random(size).sample(changes, 500)
+        found = sum(any(seen.name == change.name and seen.kind == change.kind and seen.leaderboard_type == change.leaderboard_type
+                        for seen in feed.recent(change.name.split()[0])) for change in sample)
+        tracemalloc.start()
+        lookup_feed = function_app.LeaderboardChangeFeed()
+        lookup_feed.on_refresh(previous, current)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        passed = found == len(sample) and len(feed.by_player) <= feed.players
+        results.append(passed)
+        print(f"  {'watch user: lookups':<40} {'ok  ' if passed else 'FAIL'} {found}/{len(sample)} sampled changes found, "
+              f"{len(feed.by_player)} players kept in {memory / 1024 / 1024:.1f} MiB")
+        report("on_refresh", measure(lambda: lookup_feed.on_refresh(previous, current), repeat=5))
+    return all(results)
+
+
+@benchmark
+def bench_leaderboard_queries():
+    """Columnar rank, percentile, top-N and stance queries on a cached snapshot."""
+    size = 50_000
+    snapshot = function_app.LeaderboardSnapshot(to_records(make_board(size, hardcore=False)), to_records(make_board(size, hardcore=True)))
+    softcore, hardcore = snapshot.columns["Softcore"], snapshot.columns["Hardcore"]
+    print(f"{size} characters per board")
+    for label, query in (
+        ("rank_for_rupture", lambda: softcore.rank_for_rupture(250)),
+        ("percentile", lambda: softcore.percentile(1234)),
+        ("top_alive_hardcore(25)", lambda: hardcore.top_alive_hardcore(25)),
+        ("count_per_stance", lambda: softcore.count_per_stance()),
+    ):
+        samples = measure(lambda: [query() for _ in range(1000)], repeat=10)
+        print(f"  {label:<40} {statistics.median(samples) * 1000:9.3f} us per query")
+
+
+# Discord drops autocomplete answers after 3 seconds; a refresh in flight must not come near that
+AUTOCOMPLETE_BUDGET = 0.25
+AUTOCOMPLETE_REFRESH_SECONDS = 3.0
+
+
+@benchmark
+def bench_autocomplete():
+    """
+    Username autocomplete at 50k names: the prefix query alone and the whole signed type 4 request,
+    against a fresh cache and while a slow leaderboard refresh is in flight.
+    """
+    size = 50_000
+    snapshot = function_app.LeaderboardSnapshot(to_records(make_board(size, hardcore=False)), to_records(make_board(size, hardcore=True)))
+    function_app.leaderboard_cache.put(snapshot)
+    print(f"{len(snapshot.sorted_names)} names")
+
+    prefixes = ["p", "player1", "player42", "player4999", "zz"]
+    samples = measure(lambda: [snapshot.complete(prefix) for prefix in prefixes], repeat=200)
+    print(f"  {'LeaderboardSnapshot.complete':<40} {statistics.median(samples) / len(prefixes) * 1e6:9.3f} us per query")
+
+    signing_key = SigningKey.generate()
+    function_app.DISCORD_VERIFY_KEY = signing_key.verify_key
+    handler = function_app.dr_discord_bot_handler._function.get_user_function()
+    payload = {"type": 4, "id": "1", "application_id": "1", "token": "t",
+               "data": {"id": "1", "name": "leaderboard", "type": 1, "options": [{"name": "user", "type": 3, "value": "player42", "focused": True}]}}
+    requests_ = [signed_request(signing_key, payload) for _ in range(1000)]
+
+    def run_handler():
+        samples = []
+        for req in requests_:
+            start = time.perf_counter()
+            handler(req, OutBinding())
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    report("dr_discord_bot_handler (type 4)", run_handler())
+
+    # The same requests while a slow leaderboard refresh is in flight: they must still answer from the stale snapshot
+    cache = function_app.leaderboard_cache
+    loader = cache.loader
+
+    def slow_loader():
+        time.sleep(AUTOCOMPLETE_REFRESH_SECONDS)
+        return snapshot
+
+    cache.loader = slow_loader
+    try:
+        cache._fetched_at -= cache.ttl
+        cache.get_nowait()
+        samples = run_handler()
+        in_flight = cache._refreshing
+        wait_for_refresh(cache, timeout=AUTOCOMPLETE_REFRESH_SECONDS + 5)
+    finally:
+        cache.loader = loader
+    report(f"type 4 during a {AUTOCOMPLETE_REFRESH_SECONDS:.0f}s refresh", samples)
+    passed = in_flight and max(samples) < AUTOCOMPLETE_BUDGET
+    print(f"  slowest answer {max(samples) * 1000:.1f} ms, budget {AUTOCOMPLETE_BUDGET * 1000:.0f} ms: {'ok' if passed else 'FAIL'}")
+    return passed
+
+
+@benchmark
+def bench_batch_lookup():
+    """
+    A 50 user roster against 50k character boards: one /leaderboard users= call versus 50 single
+    lookups, whether its reply splits into whole tables, and a roster of separators only.
+    """
+    size = 50_000
+    snapshot = function_app.LeaderboardSnapshot(to_records(make_board(size, hardcore=False)), to_records(make_board(size, hardcore=True)))
+    function_app.leaderboard_cache.put(snapshot)
+    roster = [f"player{n}" for n in range(0, 5_000, 100)]
+    users = ", ".join(roster)
+    report("50 x leaderboard_lookup", measure(lambda: [function_app.leaderboard_lookup(username) for username in roster], repeat=50))
+    report("leaderboard_batch_lookup (50 users)", measure(lambda: function_app.leaderboard_command({"users": users}), repeat=50))
+
+    # Every message of the reply must hold whole tables, each with its header
+    parts = function_app.split_message(function_app.leaderboard_command({"users": users}))
+    whole_tables = all(len(part) <= function_app.DISCORD_MESSAGE_LIMIT and part.count("```") == 2 and part.startswith("```\nUser ") for part in parts)
+    print(f"  50 user reply: {'ok' if whole_tables else 'FAIL'}, {len(parts)} messages of {', '.join(str(len(part)) for part in parts)} characters")
+
+    # Discord rejects an empty message, which would leave the reply pending for good
+    empty = [users for users in (",", " , ,", "\t") if not function_app.leaderboard_command({"users": users})]
+    print(f"  users= made of separators only: {'FAIL, empty reply for ' + repr(empty) if empty else 'ok'}")
+    return whole_tables and not empty
+
+
+@benchmark
+def bench_rupture_plan():
+    """
+    Planning over the whole rupture sheet: one /ruptureplan grid (every level, 4 reroll costs)
+    versus answering each level and cost with /rupturecalc. Every grid cell must match the answer
+    /rupturecalc gives for it, every reply must fit in one message, and reroll costs outside the
+    range /rupturecalc takes must be rejected.
+    """
+    rows = make_rupture_sheet()["values"][1:]
+    table = function_app.RuptureTable((int(row[0]), int(row[3]), int(row[5])) for row in rows)
+    function_app.rupture_table_cache.put(table)
+    low, high, costs = table.level[0], table.level[-1], [150, 750, 1500, 5000]
+    pairs = [(level, cost) for level in table.level for cost in costs]
+
+    report(f"{len(table.level)} levels x {len(costs)} costs, rupturecalc each", measure(lambda: [function_app.rupturecalc(level, cost) for level, cost in pairs], repeat=5))
+    report("RuptureTable.plan (same grid)", measure(lambda: table.plan(low, high, costs), repeat=50))
+    report("ruptureplan (grid and table)", measure(lambda: function_app.ruptureplan(low, high, costs), repeat=50))
+
+    plan = table.plan(low, high, costs)
+    mismatches = [(level, cost) for index, level in enumerate(plan.levels) for cost, column in zip(plan.rerollcosts, plan.runs_for_reroll)
+                  if function_app.rupturecalc(level, cost) != f"Rupture Level {level}\nRuns per Beetle: {function_app.format_runs(plan.runs_for_beetle[index])}.\n"
+                  f"Runs per reroll given cost {cost}: {function_app.format_runs(column[index])}"]
+    print(f"  {len(pairs) - len(mismatches)}/{len(pairs)} grid cells match rupturecalc" + (f", mismatches: {mismatches[:5]}" if mismatches else ""))
+
+    # A reply over the limit would be split inside its table
+    replies = {(fromlevel, tolevel, tuple(costs)): function_app.ruptureplan(fromlevel, tolevel, costs)
+               for fromlevel, tolevel in ((low, high), (low, low + 40), (high - 3, high))
+               for costs in ([], [1500, 2500, 3500, 4999], [150, 151, 152, 153], [4996, 4997, 4998, 4999, 5000, 150])}
+    too_long = {options: len(reply) for options, reply in replies.items() if len(reply) > function_app.DISCORD_MESSAGE_LIMIT}
+    print(f"  ruptureplan replies within {function_app.DISCORD_MESSAGE_LIMIT} characters: "
+          + (f"FAIL, {too_long}" if too_long else f"ok, longest {max(map(len, replies.values()))}"))
+
+    # /rupturecalc only takes costs from 150 to 5000, so /ruptureplan does not either
+    accepted = [costs for costs in ("1,2,3", "149", "5001", "0") if not function_app.ruptureplan_command({"fromlevel": low, "rerollcosts": costs}).startswith("Reroll costs must")]
+    print(f"  reroll costs out of range: {'FAIL, accepted ' + repr(accepted) if accepted else 'ok, rejected'}")
+    function_app.rupture_table_cache.clear()
+    return not mismatches and not too_long and not accepted
+
+
+# The Functions worker has azure.functions loaded before it imports function_app, so the budget
+# only covers what function_app adds on top
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "25"))
+STARTUP_PRELOAD = "import azure.functions; azure.functions.FunctionApp"
+DEFERRED_MODULES = ("requests", "nacl.signing", "sqlite3", "PIL.Image")
+
+
+def import_times(statement, bytecode=True):
+    """
+    Runs `statement` in a fresh interpreter with -X importtime. Returns the cumulative seconds of
+    each top level import of function_app and DEFERRED_MODULES and of their direct imports, plus stdout.
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    command = [sys.executable, "-X", "importtime"] + ([] if bytecode else ["-B", "-X", "pycache_prefix=" + tempfile.mkdtemp()])
+    result = subprocess.run(command + ["-c", f"{STARTUP_PRELOAD}\n{statement}"], capture_output=True, text=True, check=True,
+                            env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    times = {}
+    children = {}
+    # Modules are listed after their own imports, so direct imports are held until their parent shows up
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative) / 1e6
+        elif depth == 0:
+            if name.strip() in ("function_app",) + DEFERRED_MODULES:
+                times.update(children)
+                times[name.strip()] = int(cumulative) / 1e6
+            children = {}
+    return times, result.stdout
+
+
+@benchmark
+def bench_startup(repeat=10):
+    """
+    Import time of function_app in a fresh process against STARTUP_BUDGET_MS, with its slowest direct
+    imports, the cost each deferred module adds on first use, and the import without a bytecode cache.
+    """
+    import_times("import function_app")  # writes the bytecode cache
+    runs = [import_times("import function_app, sys; print(','.join(m for m in %r if m in sys.modules))" % (DEFERRED_MODULES,))
+            for _ in range(repeat)]
+    modules = collections.defaultdict(list)
+    for times, _ in runs:
+        for name, seconds in times.items():
+            modules[name].append(seconds)
+    total = modules.pop("function_app")
+    report("import function_app", total)
+    for name, samples in sorted(modules.items(), key=lambda item: -statistics.median(item[1]))[:5]:
+        report(f"  {name}", samples)
+    report("import function_app (no bytecode cache)", [import_times("import function_app", bytecode=False)[0]["function_app"] for _ in range(5)])
+
+    for module in DEFERRED_MODULES:
+        report(f"deferred: {module}", [import_times(f"import {module}")[0][module] for _ in range(5)])
+
+    eager = {module for _, loaded in runs for module in loaded.strip().split(",") if module}
+    within_budget = statistics.median(total) * 1000 <= STARTUP_BUDGET_MS and not eager
+    print(f"  budget {STARTUP_BUDGET_MS:.1f} ms: {'ok' if within_budget else 'EXCEEDED'}"
+          + (f" (imported at startup: {', '.join(sorted(eager))})" if eager else ""))
+    return within_budget
+
+
+def decode_worker(mode, url):
+    """Runs in a fresh process so its peak RSS only reflects one decode path."""
+    def decode():
+        if mode == "json":
+            return function_app.requests.get(url).json()["leaderboards"]
+        function_app.LEADERBOARD_API_URL = url.split("/leaderboards/")[0]
+        return function_app.fetch_leaderboard("normal")
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    board = decode()
+    elapsed = time.perf_counter() - start
+    rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+
+    # ru_maxrss only grows past the peak reached while importing, so also trace Python allocations
+    del board
+    tracemalloc.start()
+    board = decode()
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(json.dumps({"seconds": elapsed, "rss_kib": rss_kib, "traced_peak_kib": traced_peak / 1024, "entries": len(board)}))
+
+
+@benchmark
+def bench_leaderboard_decode():
+    """Decode time and peak RSS growth of response.json() dicts vs the streaming CharacterRecord decoder."""
+    for size in (10_000, 50_000):
+        stub = StubServer({"/leaderboards/scores?type=normal": json.dumps({"leaderboards": make_board(size, hardcore=False)}).encode()})
+        print(f"{size} characters")
+        for mode, label in (("json", "response.json() dicts"), ("stream", "streamed CharacterRecords")):
+            runs = []
+            for _ in range(3):
+                output = subprocess.run([sys.executable, __file__, "--decode-worker", mode, f"{stub.url}/leaderboards/scores?type=normal"],
+                                        capture_output=True, text=True, check=True).stdout
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+            print(f"  {label:<40} p50 {statistics.median(run['seconds'] for run in runs) * 1000:9.3f} ms   "
+                  f"peak RSS growth {statistics.median(run['rss_kib'] for run in runs) / 1024:7.1f} MiB   "
+                  f"traced peak {statistics.median(run['traced_peak_kib'] for run in runs) / 1024:7.1f} MiB")
+        stub.close()
+
+
+def main(names):
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(unknown)}. Available: {', '.join(BENCHMARKS)}")
+        return 2
+    failed = []
+    for name in names or BENCHMARKS:
+        print(f"== {name} ==")
+        if BENCHMARKS[name]() is False:
+            failed.append(name)
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--decode-worker"]:
+        decode_worker(*sys.argv[2:4])
+        sys.exit(0)
+    sys.exit(main(sys.argv[1:]))
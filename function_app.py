@@ -1,13 +1,58 @@
 import azure.functions as func
-import requests
 import logging
+import bisect
+import contextvars
+import importlib
+import io
 import os
+import hashlib
+import heapq
 import math
 import json
-from discord_interactions import verify_key
+import mmap
+import queue
+import re
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, deque
+from contextlib import closing, contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+
+
+class LazyModule:
+    """
+    Stands in for a module and imports it on first attribute access, so a cold start only pays
+    for the heavy modules the invoked route actually uses.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
 
+
+# requests is only needed once an interaction is processed; the ingress route just verifies and enqueues
+requests = LazyModule("requests")
+urllib3 = LazyModule("urllib3")
+nacl_signing = LazyModule("nacl.signing")
+nacl_exceptions = LazyModule("nacl.exceptions")
+sqlite3 = LazyModule("sqlite3")
+PIL_Image = LazyModule("PIL.Image")
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 logging.basicConfig()
-logging.getLogger().setLevel(logging.DEBUG)
+logging.getLogger().setLevel(LOG_LEVEL)
 
 
 DISCORD_BOT_PUBLIC_KEY = os.getenv('DISCORD_BOT_PUBLIC_KEY')
@@ -18,22 +63,120 @@ GOOGLE_API_SPREADSHEET_ID = os.getenv("GOOGLE_API_SPREADSHEET_ID")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 OCR_API_KEY = os.getenv("OCR_API_KEY")
 
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+# Where dr_discord_bot_handler hands interactions over for processing: "azure" (Storage Queue through the
+# queue output binding), or the local stand-ins "memory" and "sqlite" which are consumed by a worker thread
+WORK_QUEUE_BACKEND = os.getenv("WORK_QUEUE_BACKEND", "azure")
+WORK_QUEUE_BATCH_SIZE = int(os.getenv("WORK_QUEUE_BATCH_SIZE", "16"))
+WORK_QUEUE_SQLITE_PATH = os.getenv("WORK_QUEUE_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "dr_interaction_queue.sqlite3"))
+# Like a Storage Queue message, a claimed SQLite message is handed out again if it is not acknowledged within
+# the visibility timeout (its consumer crashed), and dropped after WORK_QUEUE_MAX_ATTEMPTS deliveries
+WORK_QUEUE_VISIBILITY_TIMEOUT = float(os.getenv("WORK_QUEUE_VISIBILITY_TIMEOUT", "300"))
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "5"))
+INTERACTION_QUEUE_NAME = "dr-discord-interactions"
+
+# OCR results are cached by image content, in memory and in a size bounded directory
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dr_ocr_cache"))
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+OCR_CACHE_MEMORY_ENTRIES = int(os.getenv("OCR_CACHE_MEMORY_ENTRIES", "256"))
+
+# Connection pool of the shared HTTP session: hosts kept, and connections kept per host
+HTTP_POOL_HOSTS = 8
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+
+# Read timeouts (seconds) per upstream; connecting may take at most UPSTREAM_CONNECT_TIMEOUT
+UPSTREAM_CONNECT_TIMEOUT = 3.05
+LEADERBOARD_TIMEOUT = float(os.getenv("LEADERBOARD_TIMEOUT", "10"))
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", "5"))
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "20"))
+ATTACHMENT_TIMEOUT = float(os.getenv("ATTACHMENT_TIMEOUT", "10"))
+# Total seconds a call to each upstream may take, reading the body included. The read timeouts only bound
+# each wait for data, so an upstream that keeps trickling bytes would otherwise hold a worker indefinitely
+LEADERBOARD_DEADLINE = float(os.getenv("LEADERBOARD_DEADLINE", "60"))
+SHEETS_DEADLINE = float(os.getenv("SHEETS_DEADLINE", "15"))
+OCR_DEADLINE = float(os.getenv("OCR_DEADLINE", "45"))
+ATTACHMENT_DEADLINE = float(os.getenv("ATTACHMENT_DEADLINE", "20"))
+# After this many failures in a row an upstream is not called for UPSTREAM_RESET_AFTER seconds
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5"))
+UPSTREAM_RESET_AFTER = float(os.getenv("UPSTREAM_RESET_AFTER", "30"))
+# GETs without response headers after this many seconds get a second, hedged request (0 disables hedging)
+UPSTREAM_HEDGE_AFTER = float(os.getenv("UPSTREAM_HEDGE_AFTER", "0"))
+
+# Rendered interaction results kept per instance (0 disables the result cache)
+INTERACTION_CACHE_ENTRIES = int(os.getenv("INTERACTION_CACHE_ENTRIES", "1024"))
+
+# With OCR_PREPROCESS=true screenshots are cropped to the item tooltip, downscaled to at most OCR_IMAGE_MAX_WIDTH
+# pixels and binarized before OCR reads them. Off by default: the tooltip finder has only been tuned on rendered
+# screenshots, and its effect on the fields OCR gets right is unmeasured, so OCR reads the original attachment
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "false").lower() == "true"
+OCR_IMAGE_MAX_WIDTH = int(os.getenv("OCR_IMAGE_MAX_WIDTH", "1200"))
+
+# Which engine reads item screenshots: "ocrspace" (the OCR.space API) or "tesseract" (the local
+# TESSERACT_COMMAND, run as at most TESSERACT_WORKERS processes at once)
+OCR_BACKEND = os.getenv("OCR_BACKEND", "ocrspace")
+TESSERACT_COMMAND = os.getenv("TESSERACT_COMMAND", "tesseract")
+TESSERACT_WORKERS = int(os.getenv("TESSERACT_WORKERS", "2"))
+
+OCR_API_URL = os.getenv("OCR_API_URL", "https://api.ocr.space/parse/image")
+DISCORD_API_URL = os.getenv("DISCORD_API_URL", "https://discord.com/api/v10")
+
+# Interactions slower than PROFILE_SLOW_MS get a sampled profile written to PROFILE_DIR (0 disables profiling)
+PROFILE_SLOW_MS = int(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "dr_profiles"))
+# Every instance logs its latency histograms at most this often (seconds), from the interactions it serves
+LATENCY_HISTOGRAM_FLUSH_SECONDS = float(os.getenv("LATENCY_HISTOGRAM_FLUSH_SECONDS", "300"))
+
+SHEETS_API_URL = os.getenv("SHEETS_API_URL", "https://sheets.googleapis.com")
+# The rupture sheet changes rarely, so it is cached for an hour and the last good copy is kept for a week
+RUPTURE_CACHE_TTL = int(os.getenv("RUPTURE_CACHE_TTL", "3600"))
+RUPTURE_CACHE_MAX_STALE = int(os.getenv("RUPTURE_CACHE_MAX_STALE", "604800"))
+LEADERBOARD_API_URL = os.getenv("LEADERBOARD_API_URL", "http://loadbalancer-e2a9b2a-1115437761.us-east-1.elb.amazonaws.com")
+# Seconds a leaderboard snapshot is served as fresh, and how long a stale one may be served while it is refreshed
+LEADERBOARD_CACHE_TTL = int(os.getenv("LEADERBOARD_CACHE_TTL", "60"))
+LEADERBOARD_CACHE_MAX_STALE = int(os.getenv("LEADERBOARD_CACHE_MAX_STALE", "900"))
+# With both set, the timer posts leaderboard changes (rank moves, rupture records, hardcore deaths) to this channel
+DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
+LEADERBOARD_WATCH_CHANNEL_ID = os.getenv("LEADERBOARD_WATCH_CHANNEL_ID")
+# Changes kept per kind (rank, rupture, death) from each refresh, and changes kept waiting to be posted
+LEADERBOARD_CHANGES_PER_KIND = int(os.getenv("LEADERBOARD_CHANGES_PER_KIND", "50"))
+LEADERBOARD_UNPOSTED_MAX = int(os.getenv("LEADERBOARD_UNPOSTED_MAX", "1000"))
+# Players (by base name) whose own latest changes are kept for /watch user:, least recently changed dropped first
+LEADERBOARD_WATCH_PLAYERS = int(os.getenv("LEADERBOARD_WATCH_PLAYERS", "50000"))
+# Written by the timer trigger so cold instances can start from disk instead of the leaderboard API. The timer
+# runs on one instance, so on Azure the file goes to $HOME/data, the app's file share that every instance
+# mounts; /tmp is per instance. Plans without a shared $HOME (Linux Consumption) need this pointed at a mount.
+LEADERBOARD_SNAPSHOT_PATH = os.getenv("LEADERBOARD_SNAPSHOT_PATH", os.path.join(
+    os.path.join(os.environ["HOME"], "data") if os.getenv("WEBSITE_INSTANCE_ID") and os.getenv("HOME") else tempfile.gettempdir(),
+    "dr_leaderboard_snapshot.bin"))
+
+# Set to "false" to stop the timer from pinging both HTTP routes; it still prefetches and posts changes
+KEEP_WARM_PINGS = os.getenv("KEEP_WARM_PINGS", "true").lower() == "true"
+
+# Built from the hex key on the first signed request instead of on every request
+DISCORD_VERIFY_KEY = None
 
 # BASE FUNCTION FUNCTIONS
-def signature_verification(req: func.HttpRequest) -> bool:
+def get_verify_key():
+    global DISCORD_VERIFY_KEY
+    if DISCORD_VERIFY_KEY is None and DISCORD_BOT_PUBLIC_KEY:
+        DISCORD_VERIFY_KEY = nacl_signing.VerifyKey(bytes.fromhex(DISCORD_BOT_PUBLIC_KEY))
+    return DISCORD_VERIFY_KEY
+
+
+def signature_verification(headers, body: bytes) -> bool:
     try:
-        signature = req.headers.get("X-Signature-Ed25519")
-        timestamp = req.headers.get("X-Signature-Timestamp")
-        body = req.get_body()
-        
-        if signature and timestamp and body:
-            if verify_key(body, signature, timestamp, DISCORD_BOT_PUBLIC_KEY):
-                logging.info("Discord signature has been verified.")
-                return True
-            else:
+        signature = headers.get("X-Signature-Ed25519")
+        timestamp = headers.get("X-Signature-Timestamp")
+        verify_key = get_verify_key()
+
+        if signature and timestamp and body and verify_key:
+            try:
+                verify_key.verify(timestamp.encode() + body, bytes.fromhex(signature))
+            except (nacl_exceptions.BadSignatureError, ValueError):
                 logging.error("Signature is invalid")
                 return False
+            logging.info("Discord signature has been verified.")
+            return True
         else:
             #logging.error("Missing required headers or body.")
             return False
@@ -61,60 +204,438 @@ def create_http_response(content, status_code, mimetype="application/json"):
     logging.info (f"Creating HTTP response with status code {status_code}")
     return func.HttpResponse(json.dumps(content), status_code=status_code, mimetype=mimetype)
 
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    The process-wide requests session every outbound call goes through, so connections (and TLS
+    sessions) to the leaderboard API, Sheets, OCR.space and Discord are kept alive and reused.
+    Created on first use; requests.Session is safe to share between threads for these calls.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+# ----------------------------------------------------------------------------
+# --------------------------- INSTRUMENTATION --------------------------------
+# ----------------------------------------------------------------------------
+
+# Stage name -> seconds spent in it during the current interaction (inclusive of nested stages)
+_stage_timings = contextvars.ContextVar("stage_timings", default=None)
+# The failures reported with reply_failed while the current interaction's reply was built
+_reply_failures = contextvars.ContextVar("reply_failures", default=None)
+# Pool threads run stages in a copy of the interaction's context, so they update the same timings dict
+_stage_timings_lock = threading.Lock()
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.total_ms = 0.0
+
+    def observe(self, duration_ms):
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if duration_ms <= bound:
+                self.counts[i] += 1
+                break
+        self.total_ms += duration_ms
+
+    def to_dict(self):
+        return {
+            "count": sum(self.counts),
+            "sum_ms": round(self.total_ms, 3),
+            "buckets": {("inf" if bound == float("inf") else str(bound)): count for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)},
+        }
+
+
+# (command, stage) -> LatencyHistogram; the stage "total" covers the whole interaction
+latency_histograms = {}
+_latency_histograms_lock = threading.Lock()
+_latency_histograms_flush_at = time.monotonic() + LATENCY_HISTOGRAM_FLUSH_SECONDS
+
+
+@contextmanager
+def stage(name):
+    """Adds the time spent in the block to `name` in the current interaction's stage timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _stage_timings.get()
+        if timings is not None:
+            elapsed = time.perf_counter() - start
+            with _stage_timings_lock:
+                timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed(name):
+    """Decorator form of `stage`."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reply_failed(message):
+    """Returns `message` as the reply, marked as an error so the interaction result cache does not keep it."""
+    failures = _reply_failures.get()
+    if failures is not None:
+        failures.append(message)
+    return message
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread every `interval` seconds from a background thread and counts
+    the collapsed stacks, which is cheap enough to leave on and only dump for slow invocations.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+
+def dump_profile(command_name, samples):
+    """Writes the samples in collapsed stack format, which flamegraph tools read directly."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}-{command_name or 'unknown'}-{threading.get_ident()}.folded")
+    with open(path, "w") as file:
+        for stack, count in samples.most_common():
+            file.write(f"{stack} {count}\n")
+    return path
+
+
+@contextmanager
+def instrumented_interaction(command_name):
+    """
+    Times one interaction: collects stage timings, records them in the per-command histograms and
+    logs them as one structured record. With PROFILE_SLOW_MS set the interaction is also sampled,
+    and the profile is kept when it ran longer than that.
+    """
+    global _latency_histograms_flush_at
+    timings = {}
+    token = _stage_timings.set(timings)
+    profiler = SamplingProfiler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000).start() if PROFILE_SLOW_MS > 0 else None
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        total_ms = (time.perf_counter() - start) * 1000
+        _stage_timings.reset(token)
+
+        with _stage_timings_lock:
+            stages_ms = {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+        with _latency_histograms_lock:
+            for name, duration_ms in [("total", total_ms), *stages_ms.items()]:
+                latency_histograms.setdefault((command_name, name), LatencyHistogram()).observe(duration_ms)
+            flush = time.monotonic() >= _latency_histograms_flush_at
+            if flush:
+                _latency_histograms_flush_at = time.monotonic() + LATENCY_HISTOGRAM_FLUSH_SECONDS
+
+        record = {"command": command_name, "total_ms": round(total_ms, 3), "stages_ms": stages_ms}
+        if profiler is not None:
+            samples = profiler.stop()
+            if total_ms >= PROFILE_SLOW_MS:
+                record["profile"] = dump_profile(command_name, samples)
+        # Application Insights keeps custom_dimensions as customDimensions; the JSON message keeps it queryable from plain traces
+        logging.info(f"interaction_timing {json.dumps(record)}", extra={"custom_dimensions": record})
+        if flush:
+            log_latency_histograms()
+
+
+def log_latency_histograms():
+    """Logs the histograms of this instance; called by the timer and every LATENCY_HISTOGRAM_FLUSH_SECONDS from interactions."""
+    global _latency_histograms_flush_at
+    with _latency_histograms_lock:
+        _latency_histograms_flush_at = time.monotonic() + LATENCY_HISTOGRAM_FLUSH_SECONDS
+        snapshot = {f"{command}/{name}": histogram.to_dict() for (command, name), histogram in latency_histograms.items()}
+    if snapshot:
+        logging.info(f"interaction_latency_histograms {json.dumps(snapshot)}", extra={"custom_dimensions": {"histograms": json.dumps(snapshot)}})
+
+
+# ----------------------------------------------------------------------------
+# ------------------------------ WORK QUEUE ----------------------------------
+# ----------------------------------------------------------------------------
+
+class BindingWorkQueue:
+    """Writes the message to the Storage Queue output binding of the current invocation."""
+
+    def __init__(self, binding):
+        self.binding = binding
+
+    def put(self, message):
+        self.binding.set(message)
+
+
+class LocalWorkQueue:
+    """
+    Base for the local stand-ins of the Storage Queue. A daemon thread takes up to
+    WORK_QUEUE_BATCH_SIZE messages at a time, hands them to process_interaction_batch and only
+    then acknowledges them.
+
+    get_batch returns (receipt, message) tuples; the receipts are passed to ack once the messages
+    are handled.
+    """
+
+    def __init__(self):
+        self._consumer = None
+        self._consumer_lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def put(self, message):
+        self._put(message)
+        self._ensure_consumer()
+
+    def close(self):
+        """Stops the consumer after its current batch; unacknowledged messages stay queued."""
+        self._closed.set()
+        with self._consumer_lock:
+            consumer = self._consumer
+        if consumer is not None:
+            consumer.join()
+
+    def _ensure_consumer(self):
+        with self._consumer_lock:
+            if self._consumer is None:
+                self._consumer = threading.Thread(target=self._consume, name=f"{type(self).__name__}-consumer", daemon=True)
+                self._consumer.start()
+
+    def _consume(self):
+        while not self._closed.is_set():
+            try:
+                batch = self.get_batch(WORK_QUEUE_BATCH_SIZE)
+            except Exception as e:
+                # A locked or briefly unavailable queue must not stop consumption for good
+                logging.error(f"Failed to read the work queue: {e}")
+                self._closed.wait(1.0)
+                continue
+            if batch:
+                process_interaction_batch([message for _, message in batch])
+                self.ack([receipt for receipt, _ in batch])
+
+
+class InProcessWorkQueue(LocalWorkQueue):
+    def __init__(self):
+        super().__init__()
+        self._queue = queue.Queue()
+
+    def _put(self, message):
+        self._queue.put(message)
+
+    def get_batch(self, max_messages, timeout=1.0):
+        try:
+            messages = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(messages) < max_messages:
+            try:
+                messages.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        # Nothing outlives the process, so there is nothing to acknowledge
+        return [(None, message) for message in messages]
+
+    def ack(self, receipts):
+        pass
+
+
+class SQLiteWorkQueue(LocalWorkQueue):
+    """
+    Keeps pending messages in a SQLite file so they survive a restart of the local host. A message
+    is only deleted when it is acknowledged; until then it is claimed for `visibility_timeout`
+    seconds, after which another get_batch hands it out again.
+    """
+
+    def __init__(self, path, poll_interval=0.2, visibility_timeout=WORK_QUEUE_VISIBILITY_TIMEOUT, max_attempts=WORK_QUEUE_MAX_ATTEMPTS):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        with closing(self._connect()) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL)")
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(messages)")}
+            # Queue files from before messages were acknowledged lack the claim columns
+            if "claimed_until" not in columns:
+                connection.execute("ALTER TABLE messages ADD COLUMN claimed_until REAL NOT NULL DEFAULT 0")
+            if "attempts" not in columns:
+                connection.execute("ALTER TABLE messages ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _put(self, message):
+        with closing(self._connect()) as connection:
+            connection.execute("INSERT INTO messages (body) VALUES (?)", (message,))
+        self._wakeup.set()
+
+    def get_batch(self, max_messages, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            # Claims are wall clock times so they stay meaningful across a restart
+            now = time.time()
+            with closing(self._connect()) as connection:
+                connection.execute("BEGIN IMMEDIATE")
+                rows = connection.execute("SELECT id, body, attempts FROM messages WHERE claimed_until <= ? ORDER BY id LIMIT ?",
+                                          (now, max_messages)).fetchall()
+                poisoned = [row for row in rows if row[2] >= self.max_attempts]
+                rows = [row for row in rows if row[2] < self.max_attempts]
+                if poisoned:
+                    connection.execute(f"DELETE FROM messages WHERE id IN ({','.join('?' * len(poisoned))})", [row[0] for row in poisoned])
+                if rows:
+                    connection.execute(f"UPDATE messages SET claimed_until = ?, attempts = attempts + 1 WHERE id IN ({','.join('?' * len(rows))})",
+                                       [now + self.visibility_timeout] + [row[0] for row in rows])
+                connection.execute("COMMIT")
+            for row in poisoned:
+                logging.error(f"Dropping queued interaction {row[0]} after {row[2]} delivery attempts")
+            if rows or time.monotonic() >= deadline:
+                return [(row[0], row[1]) for row in rows]
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def ack(self, receipts):
+        if not receipts:
+            return
+        with closing(self._connect()) as connection:
+            connection.execute(f"DELETE FROM messages WHERE id IN ({','.join('?' * len(receipts))})", receipts)
+
+
+_local_work_queue = None
+_local_work_queue_lock = threading.Lock()
+
+
+def get_work_queue(binding):
+    """Returns the queue configured by WORK_QUEUE_BACKEND; `binding` is the handler's queue output binding."""
+    global _local_work_queue
+    if WORK_QUEUE_BACKEND == "azure":
+        return BindingWorkQueue(binding)
+    with _local_work_queue_lock:
+        if _local_work_queue is None:
+            if WORK_QUEUE_BACKEND == "memory":
+                _local_work_queue = InProcessWorkQueue()
+            elif WORK_QUEUE_BACKEND == "sqlite":
+                _local_work_queue = SQLiteWorkQueue(WORK_QUEUE_SQLITE_PATH)
+            else:
+                raise ValueError(f"Unknown WORK_QUEUE_BACKEND {WORK_QUEUE_BACKEND}")
+        return _local_work_queue
+
+
+def process_interaction(raw_req):
+    with instrumented_interaction(raw_req.get("data", {}).get("name", "")):
+        with stage("interact"):
+            content = cached_interact(raw_req)
+        logging.debug(f"Interaction result: {content}")
+
+        send_discord_followup(raw_req, content)
+        logging.info('Follow-up sent successfully.')
+
+
+def process_interaction_batch(messages):
+    """
+    Processes queued interactions. Each message is a JSON encoded interaction; a failing
+    message does not stop the rest of the batch.
+
+    Returns:
+        int: The number of messages that failed.
+    """
+    failed = 0
+    for message in messages:
+        try:
+            process_interaction(json.loads(message))
+        except Exception as e:
+            failed += 1
+            logging.error(f"Failed to process queued interaction: {e}")
+    return failed
+
 # ----------------------------------------------------------------------------
 # ---------------------------- BASE FUNCTION ---------------------------------
 # ----------------------------------------------------------------------------
 
 app = func.FunctionApp()
 @app.route(route="dr_discord_bot_handler", auth_level=func.AuthLevel.FUNCTION)
-def dr_discord_bot_handler(req: func.HttpRequest) -> func.HttpResponse:
+@app.queue_output(arg_name="interaction_queue", queue_name=INTERACTION_QUEUE_NAME, connection="AzureWebJobsStorage")
+def dr_discord_bot_handler(req: func.HttpRequest, interaction_queue: func.Out[str]) -> func.HttpResponse:
     #try:
     logging.info('Python HTTP trigger function processed a request.')
-    
+
+    # The raw body is read and parsed once; the signature is checked against the same bytes
+    body = req.get_body()
+    try:
+        req_body = json.loads(body)
+    except ValueError:
+        logging.warning("Request body is not valid JSON")
+        return create_http_response("Invalid request body", 400)
+
     # Verify request signature
-    if req.get_json()['type'] == 'warmup':
+    if req_body.get('type') == 'warmup':
         logging.info('Received warmup request.')
         response = 'Warmed up'
         status_code = 200
         return create_http_response(response, status_code)
-    elif not signature_verification(req):
+    elif not signature_verification(req.headers, body):
         logging.warning("Invalid request signature")
         return create_http_response("Invalid request signature", 401)
 
-    req_body = req.get_json()
     #logging.debug(f"Request body: {req_body}")
 
     if req_body["type"] == 1:
         response = {"type": 1}
         status_code = 200
+    elif req_body["type"] == 4:
+        # Autocomplete is answered inline, it cannot be deferred
+        response = {"type": 8, "data": {"choices": autocomplete_choices(req_body)}}
+        status_code = 200
     elif req_body["type"] == 2:
         logging.info("Type 2, submitting to queue and deferring")
+        try:
+            # The verified body is already the JSON the consumer needs
+            get_work_queue(interaction_queue).put(body.decode("utf-8"))
+        except Exception as e:
+            # Without a queued message nobody would ever answer, so tell Discord right away
+            logging.error(f"Failed to queue interaction: {e}")
+            return create_http_response({"type": 4, "data": {"content": "Something went wrong, please try again."}}, 200)
         response = {
             "type": 5,
             "content": "Pending"
         }
         status_code = 200
-        url = f"{AZFUNC}/api/dr_discord_bot_interaction_handler?code={INTERACTION_FUNCTION_KEY}"
-        #logging.warning(f"Requesting URL: {url}") # Potentially sensitive
-
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-    #except Exception as e:
-        #logging.error(f"Unexpected error in base function: {e}")
-        #return create_http_response("Internal server error", 500)
-        
-        try:
-            print(url)
-            res = requests.post(url, headers=headers, json=req_body, timeout=1)
-            #res.raise_for_status()
-            logging.info(f"Response status code: {res.status_code}")
-        except requests.exceptions.RequestException as e:
-            logging.warning(f"Request either timed out like expected or something else happened: {e}")
-        except Exception as e:
-            logging.error(f"Unexpected error in base function: {e}")
-            #return create_http_response("Internal server error", 500)
     return create_http_response(response, status_code)
     
 
@@ -122,177 +643,1258 @@ def dr_discord_bot_handler(req: func.HttpRequest) -> func.HttpResponse:
 # INTERACTION FUNCTION FUNCTIONS
 
 
-def rupturecalc(rupturelevel, rerollcost):
-    spreadsheet_range = "Rupture Boss Chest Calculated Data!A1:H"
-    spreadsheet_url = f"https://sheets.googleapis.com/v4/spreadsheets/{GOOGLE_API_SPREADSHEET_ID}/values/{spreadsheet_range}?key={GOOGLE_API_KEY}"
-    
+# ----------------------------------------------------------------------------
+# ---------------------------- UPSTREAM CLIENT -------------------------------
+# ----------------------------------------------------------------------------
+class UpstreamUnavailable(Exception):
+    pass
+
+
+class UpstreamDeadlineExceeded(Exception):
+    pass
+
+
+class Upstream:
+    """
+    Calls one upstream dependency over the shared HTTP session with bounded waits.
+
+    Every request gets the upstream's (connect, read) timeout, and the whole call, reading the
+    body included, must finish within `deadline` seconds (give or take one read timeout) or it
+    raises UpstreamDeadlineExceeded. A response requested with stream=True is read through
+    iter_content to stay within the deadline.
+
+    Connection errors, timeouts and 5xx responses count as failures; after `failure_threshold` in
+    a row the circuit opens and calls raise UpstreamUnavailable without touching the network for
+    `reset_after` seconds. Then requests are let through again (half open): the first success
+    closes the circuit, the first failure opens it for another `reset_after` seconds.
+
+    With `hedge_after` set, a GET that has no response after that many seconds gets a second
+    request, and whichever answers first is used.
+    """
+
+    def __init__(self, name, read_timeout, deadline, failure_threshold=UPSTREAM_FAILURE_THRESHOLD, reset_after=UPSTREAM_RESET_AFTER,
+                 hedge_after=UPSTREAM_HEDGE_AFTER):
+        self.name = name
+        self.timeout = (UPSTREAM_CONNECT_TIMEOUT, min(read_timeout, deadline))
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.hedge_after = hedge_after
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, stream=False, **kwargs):
+        self._admit()
+        deadline = time.monotonic() + self.deadline
+        kwargs.setdefault("timeout", self.timeout)
+        # The body is always streamed, so that reading it can be cut off at the deadline
+        kwargs["stream"] = True
+        try:
+            if method == "GET" and self.hedge_after > 0:
+                response = self._hedged(url, kwargs)
+            else:
+                response = get_http_session().request(method, url, **kwargs)
+            response.deadline = deadline
+            if not stream:
+                response._content = b"".join(self._read(response, 64 * 1024))
+        except Exception:
+            self._record(False)
+            raise
+        self._record(response.status_code < 500)
+        return response
+
+    def iter_content(self, response, chunk_size=64 * 1024):
+        """Yields the body of a response requested with stream=True as it arrives, until the call's deadline."""
+        try:
+            yield from self._read(response, chunk_size)
+        except (requests.exceptions.RequestException, UpstreamDeadlineExceeded):
+            self._record(False)
+            raise
+
+    def _read(self, response, chunk_size):
+        with response:
+            while True:
+                if time.monotonic() >= response.deadline:
+                    raise UpstreamDeadlineExceeded(f"{self.name} did not finish its response within {self.deadline}s")
+                try:
+                    # Unlike read, read1 returns whatever has arrived instead of waiting for a full chunk
+                    chunk = response.raw.read1(chunk_size, decode_content=True)
+                except urllib3.exceptions.HTTPError as e:
+                    raise requests.exceptions.ConnectionError(e) from e
+                if not chunk:
+                    response._content_consumed = True
+                    return
+                yield chunk
+
+    def _admit(self):
+        with self._lock:
+            if self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_after:
+                raise UpstreamUnavailable(f"{self.name} is unavailable after {self._failures} failures in a row")
+
+    def _record(self, success):
+        with self._lock:
+            if success:
+                if self._opened_at is not None:
+                    logging.info(f"Closing the {self.name} circuit")
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logging.warning(f"Opening the {self.name} circuit after {self._failures} failures in a row")
+                self._opened_at = time.monotonic()
+
+    def _hedged(self, url, kwargs):
+        session = get_http_session()
+        futures = [upstream_hedge_pool.submit(session.get, url, **kwargs)]
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if not done:
+            logging.info(f"No response from {self.name} after {self.hedge_after}s, sending a hedged request")
+            futures.append(upstream_hedge_pool.submit(session.get, url, **kwargs))
+        error = None
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            # The other request is closed whenever it finishes
+            for other in futures:
+                if other is not future:
+                    other.add_done_callback(close_response)
+            return future.result()
+        raise error
+
+
+def close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+upstream_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="upstream-hedge")
+leaderboard_upstream = Upstream("leaderboard API", LEADERBOARD_TIMEOUT, LEADERBOARD_DEADLINE)
+sheets_upstream = Upstream("Sheets API", SHEETS_TIMEOUT, SHEETS_DEADLINE)
+ocr_upstream = Upstream("OCR API", OCR_TIMEOUT, OCR_DEADLINE)
+attachment_upstream = Upstream("Discord attachments", ATTACHMENT_TIMEOUT, ATTACHMENT_DEADLINE)
+
+
+# ----------------------------------------------------------------------------
+# ---------------------------- SNAPSHOT CACHE --------------------------------
+# ----------------------------------------------------------------------------
+
+class InFlightCall:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls per key: while a call for a key is running, other callers with the
+    same key wait for it and share its result, or get its exception raised. A caller arriving after
+    the call finished starts a new one.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = InFlightCall()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class SnapshotCache:
+    """
+    Process-wide cache for a value produced by a (slow) loader function.
+
+    A value younger than `ttl` seconds is served as is. An older value is still served while a
+    single background thread refreshes it (stale-while-revalidate), until it is older than
+    `max_stale` seconds, after which callers wait for the refresh. Callers waiting at the same time
+    share one refresh, and its outcome. When a refresh fails the last good value is kept, so
+    callers only get None if nothing was ever loaded, and `stale_notice` tells them when they are
+    being served such a value.
+
+    If a `seed` function is given it is tried once before the first load. It returns a
+    (value, age in seconds) tuple or None, and lets a cold instance start from a persisted copy.
+
+    Functions registered with `add_listener` are called with (previous, new) value whenever a
+    refresh or `put` replaces the value. `version` is bumped after the listeners ran, so anything
+    keyed on it never pairs a new version with state the listeners have not updated yet.
+
+    Readers never take a lock that is held while the loader runs: `_load_lock` only serializes
+    refreshes, `_lock` only covers swapping the value in, and `_refresh_guard` only the check
+    whether a background refresh is already running.
+    """
+
+    def __init__(self, name, loader, ttl, max_stale, seed=None):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.seed = seed
+        self._value = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._seed_lock = threading.Lock()
+        self._refresh_guard = threading.Lock()
+        self._refreshing = False
+        self._seeded = False
+        self._listeners = []
+        self._flight = SingleFlight()
+        self._failed_at = None
+        self.version = 0
+
+    def get(self):
+        if self._value is None and self.seed is not None and not self._seeded:
+            self._seed_once()
+        value = self._value
+        age = time.monotonic() - self._fetched_at
+        if value is not None and age < self.ttl:
+            return value
+        if value is not None and age < self.max_stale:
+            self._refresh_in_background()
+            return value
+        return self._refresh_blocking()
+
+    def get_nowait(self):
+        """
+        Like `get`, but never waits on the loader: returns whatever is cached (possibly stale, or
+        None) and starts a background refresh when the value is missing or past its TTL.
+        """
+        if self._value is None and self.seed is not None and not self._seeded:
+            self._seed_once()
+        value = self._value
+        if value is None or time.monotonic() - self._fetched_at >= self.ttl:
+            self._refresh_in_background()
+        return value
+
+    def current_version(self):
+        """
+        The version of the value `get` would serve without waiting, or None when `get` would have
+        to wait on the loader. Starts a background refresh when the value is past its TTL.
+        """
+        if self._value is None and self.seed is not None and not self._seeded:
+            self._seed_once()
+        version = self.version
+        age = time.monotonic() - self._fetched_at
+        if self._value is None or age >= self.max_stale:
+            return None
+        if age >= self.ttl:
+            self._refresh_in_background()
+        return version
+
+    def stale_notice(self):
+        """A note for replies built from the cached value after its refresh failed past the TTL, else an empty string."""
+        age = time.monotonic() - self._fetched_at
+        if self._value is None or self._failed_at is None or age < self.ttl:
+            return ""
+        return f"\n\n*Showing {self.name} data from {format_age(age)} ago, it could not be refreshed.*"
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def put(self, value):
+        with self._lock:
+            self._replace(value)
+
+    def _replace(self, value):
+        previous = self._value
+        self._value = value
+        self._fetched_at = time.monotonic()
+        self._failed_at = None
+        for listener in self._listeners:
+            try:
+                listener(previous, value)
+            except Exception as e:
+                logging.error(f"{self.name} cache listener failed: {e}")
+        self.version += 1
+
+    def clear(self):
+        with self._lock:
+            self._value = None
+            self._fetched_at = 0.0
+            self.version += 1
+
+    def _seed_once(self):
+        # Only the first callers of a cold cache wait here, and they have nothing else to serve
+        with self._seed_lock:
+            if self._seeded:
+                return
+            self._seeded = True
+            try:
+                seeded = self.seed()
+            except Exception as e:
+                logging.warning(f"Could not seed {self.name} cache: {e}")
+                return
+            if seeded is None:
+                return
+            value, age = seeded
+            if age < self.max_stale:
+                with self._lock:
+                    if self._value is not None:
+                        return
+                    self._value = value
+                    self._fetched_at = time.monotonic() - age
+                    self.version += 1
+                logging.info(f"Seeded {self.name} cache with a {age:.0f}s old copy")
+
+    def _refresh_blocking(self):
+        return self._flight.do(self.name, self._refresh_if_stale)
+
+    def _refresh_if_stale(self):
+        with self._load_lock:
+            # Another refresh may have finished while we waited for the lock
+            if self._value is not None and time.monotonic() - self._fetched_at < self.ttl:
+                return self._value
+            self._refresh()
+            return self._value
+
+    def _refresh_in_background(self):
+        with self._refresh_guard:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name=f"{self.name}-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh_if_stale()
+        finally:
+            with self._refresh_guard:
+                self._refreshing = False
+
+    def _refresh(self):
+        start = time.monotonic()
+        try:
+            value = self.loader()
+        except Exception as e:
+            self._failed_at = time.monotonic()
+            logging.error(f"Failed to refresh {self.name} cache, keeping last good value: {e}")
+            return
+        with self._lock:
+            self._replace(value)
+        logging.info(f"Refreshed {self.name} cache in {self._fetched_at - start:.2f}s")
+
+
+def format_age(seconds):
+    if seconds < 120:
+        return f"{seconds:.0f} seconds"
+    if seconds < 2 * 3600:
+        return f"{seconds / 60:.0f} minutes"
+    return f"{seconds / 3600:.0f} hours"
+
+
+def parse_int(value):
     try:
-        # Call the Sheets API
-        result = requests.get(url=spreadsheet_url)
-        values = result.json().get("values", [])
-        
-        if not values:
-            logging.warning("No data found in sheet.")
-            return "No data found in sheet."
-        
-        for row in values[1:]:
-            if int(row[0]) == rupturelevel:
-                craftmat_avg_needed = int(row[3])
-                time_essence_needed = 100
-                
-                # Calculate runs for CraftMat Avg
-                runs_for_reroll = round(rerollcost / craftmat_avg_needed, 2)
-                runs_for_reroll_rounded = math.ceil(runs_for_reroll)
-                
-                # Calculate runs for Time Essence
-                runs_for_beetle = round(time_essence_needed / int(row[5]), 2)
-                runs_for_beetle_rounded = math.ceil(runs_for_beetle)
-                
-                content = (
-                    f"Rupture Level {rupturelevel}\n"
-                    f"Runs per Beetle: {runs_for_beetle_rounded} ({runs_for_beetle}).\n"
-                    f"Runs per reroll given cost {rerollcost}: {runs_for_reroll_rounded} ({runs_for_reroll})"
-                )
-                
-                return content
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class CharacterRecord:
+    """
+    The fields of a leaderboard entry the bot reads. Numbers are parsed once, and the strings
+    repeated across a board (stance, mod texts) are interned so every character shares them.
+    """
+    __slots__ = ("id", "name", "base_name", "rupture_level", "level", "rating", "deaths", "is_hardcore", "stance", "trinket_mod", "goblet_mod", "horn_mod")
+
+    def __init__(self, character_id, name, rupture_level, level, rating, deaths, is_hardcore, stance, trinket_mod, goblet_mod, horn_mod):
+        self.id = character_id
+        self.name = name
+        name_parts = name.split()
+        self.base_name = name_parts[0].lower() if name_parts else ""
+        self.rupture_level = rupture_level
+        self.level = level
+        self.rating = rating
+        self.deaths = deaths
+        self.is_hardcore = is_hardcore
+        self.stance = sys.intern(stance)
+        self.trinket_mod = sys.intern(trinket_mod)
+        self.goblet_mod = sys.intern(goblet_mod)
+        self.horn_mod = sys.intern(horn_mod)
+
+    @classmethod
+    def from_api(cls, character_info):
+        build = character_info.get("build") or {}
+        return cls(
+            character_info["id"],
+            character_info["name"],
+            parse_int(character_info.get("raptureLevel")),
+            parse_int(character_info.get("level")),
+            parse_int(character_info.get("rating")),
+            parse_int(character_info.get("deaths")),
+            bool(character_info.get("isHardcore")),
+            character_info.get("stance") or "",
+            build.get("trinketMod") or "",
+            build.get("gobletMod") or "",
+            build.get("hornMod") or "",
+        )
+
+    @property
+    def offhand(self):
+        return get_offhand_type(self.trinket_mod, self.goblet_mod, self.horn_mod)
+
+
+class LeaderboardColumns:
+    """
+    One board held as typed column arrays, in ranking order, plus the orderings the rank and top
+    queries need. Everything is built once per snapshot, so each query is a bisect or a slice.
+    """
+
+    def __init__(self, characters):
+        self.characters = characters
+        self.rupture_level = array("I", (character.rupture_level for character in characters))
+        self.level = array("I", (character.level for character in characters))
+        self.rating = array("I", (character.rating for character in characters))
+        self.deaths = array("I", (character.deaths for character in characters))
+        self.is_hardcore = array("B", (character.is_hardcore for character in characters))
+        self.stances = sorted({character.stance for character in characters})
+        stance_codes = {stance: code for code, stance in enumerate(self.stances)}
+        self.stance_code = array("H", (stance_codes[character.stance] for character in characters))
+
+        self.rupture_level_sorted = array("I", sorted(self.rupture_level))
+        alive = [i for i in range(len(characters)) if self.is_hardcore[i] and self.deaths[i] == 0]
+        self.alive_hardcore_by_rating = array("I", sorted(alive, key=lambda i: self.rating[i], reverse=True))
+        self.stance_counts = Counter(self.stance_code)
+
+    def __len__(self):
+        return len(self.characters)
+
+    def rank_for_rupture(self, rupture_level):
+        """The ranking a character at `rupture_level` would have: one below everyone strictly higher."""
+        return len(self) - bisect.bisect_right(self.rupture_level_sorted, rupture_level) + 1
+
+    def percentile(self, ranking):
+        """Share of the board at or above `ranking`, as a percentage (1.0 means top 1%). A ranking past the end counts as 100%."""
+        return min(100.0, 100.0 * ranking / len(self)) if len(self) else 0.0
+
+    def top_alive_hardcore(self, count):
+        return [self.characters[i] for i in self.alive_hardcore_by_rating[:count]]
+
+    def count_per_stance(self):
+        return {self.stances[code]: count for code, count in self.stance_counts.most_common()}
+
+
+class LeaderboardSnapshot:
+    """
+    Both leaderboards at one point in time as lists of CharacterRecord, indexed by lowercased
+    base name (`name.split()[0]`).
+
+    Each index entry has the same shape `get_user_characters` returns: leaderboard_type,
+    character_info (the CharacterRecord) and a precomputed ranking.
+    """
+
+    def __init__(self, softcore, hardcore, fetched_at=None):
+        self.boards = {"Softcore": softcore, "Hardcore": hardcore}
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.columns = {leaderboard_type: LeaderboardColumns(characters) for leaderboard_type, characters in self.boards.items()}
+        self.index = {}
+        for leaderboard_type, characters in self.boards.items():
+            for ranking, character in enumerate(characters, start=1):
+                if not character.base_name:
+                    continue
+                entry = {"leaderboard_type": leaderboard_type, "character_info": character, "ranking": ranking, "board_size": len(characters)}
+                self.index.setdefault(character.base_name, []).append(entry)
+        # Sorted base names for prefix search, each with the spelling of its first character
+        self.display_names = {base_name: entries[0]["character_info"].name.split()[0] for base_name, entries in self.index.items()}
+        self.sorted_names = sorted(self.index)
+
+    def lookup(self, username):
+        return list(self.index.get(username.lower(), []))
+
+    def complete(self, prefix, limit=25):
+        """Up to `limit` display names whose base name starts with `prefix` (case insensitive), alphabetically."""
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.sorted_names, prefix)
+        names = []
+        for base_name in self.sorted_names[start:start + limit]:
+            if not base_name.startswith(prefix):
+                break
+            names.append(self.display_names[base_name])
+        return names
+
+
+LEADERBOARD_ARRAY_START = re.compile(r'"leaderboards"\s*:\s*\[')
+JSON_WHITESPACE_AND_COMMAS = re.compile(r"[\s,]*")
+
+
+def iter_leaderboard_entries(chunks):
+    """
+    Decodes the `leaderboards` array of a leaderboard API response one entry at a time from an
+    iterable of text chunks, so neither the whole document nor the whole array of dicts is ever
+    held in memory.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    position = None
+    exhausted = False
+
+    while True:
+        if position is None:
+            match = LEADERBOARD_ARRAY_START.search(buffer)
+            if match:
+                position = match.end()
+        else:
+            position = JSON_WHITESPACE_AND_COMMAS.match(buffer, position).end()
+            if position < len(buffer):
+                if buffer[position] == "]":
+                    return
+                try:
+                    entry, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # Most likely the entry continues in the next chunk
+                    if exhausted:
+                        raise
+                else:
+                    yield entry
+                    position = end
+                    continue
+
+        if exhausted:
+            raise ValueError("Leaderboard response ended before the leaderboards array was complete")
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+        elif position is None:
+            buffer += chunk
+        else:
+            # Drop the entries already decoded
+            buffer, position = buffer[position:] + chunk, 0
+
+
+def fetch_leaderboard(board_type):
+    with stage("leaderboard_fetch"):
+        response = leaderboard_upstream.get(f"{LEADERBOARD_API_URL}/leaderboards/scores?type={board_type}", stream=True)
+        response.raise_for_status()
+    with stage("leaderboard_decode"):
+        response.encoding = response.encoding or "utf-8"
+        chunks = requests.utils.stream_decode_response_unicode(leaderboard_upstream.iter_content(response), response)
+        return [CharacterRecord.from_api(entry) for entry in iter_leaderboard_entries(chunks)]
+
+
+# Fetches the softcore board while the calling thread fetches the hardcore one
+leaderboard_fetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="leaderboard-fetch")
+
+
+def load_leaderboard_snapshot():
+    softcore = leaderboard_fetch_pool.submit(contextvars.copy_context().run, fetch_leaderboard, "normal")
+    hardcore = fetch_leaderboard("hardcore")
+    return LeaderboardSnapshot(softcore.result(), hardcore)
+
+
+# Snapshot file layout (little endian):
+#   header: magic, format version, fields per record, fetched_at (unix time), string count, string blob size
+#   string table: (string count + 1) uint32 offsets into the utf-8 blob, then the blob
+#   per board (softcore, hardcore): uint32 record count, then records of uint32 fields, which are
+#   string table indices for SNAPSHOT_STRING_FIELDS followed by the values of SNAPSHOT_INT_FIELDS
+SNAPSHOT_MAGIC = b"DRLB"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sHHdII")
+SNAPSHOT_STRING_FIELDS = ("id", "name", "stance", "trinket_mod", "goblet_mod", "horn_mod")
+SNAPSHOT_INT_FIELDS = ("rupture_level", "level", "rating", "deaths")
+SNAPSHOT_FIELD_COUNT = len(SNAPSHOT_STRING_FIELDS) + len(SNAPSHOT_INT_FIELDS)
+
+
+def write_snapshot_file(snapshot, path=LEADERBOARD_SNAPSHOT_PATH):
+    strings = {}
+    boards = []
+    for characters in snapshot.boards.values():
+        records = array("I")
+        for character in characters:
+            records.extend(strings.setdefault(getattr(character, field), len(strings)) for field in SNAPSHOT_STRING_FIELDS)
+            records.extend(getattr(character, field) for field in SNAPSHOT_INT_FIELDS)
+        boards.append(records)
+
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = array("I", [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    blob = b"".join(encoded)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_FIELD_COUNT, snapshot.fetched_at, len(encoded), len(blob)))
+        file.write(offsets.tobytes())
+        file.write(blob)
+        for records in boards:
+            file.write(struct.pack("<I", len(records) // SNAPSHOT_FIELD_COUNT))
+            file.write(records.tobytes())
+    # Readers never see a half-written file
+    os.replace(tmp_path, path)
+
+
+def read_snapshot_file(path=LEADERBOARD_SNAPSHOT_PATH):
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, field_count, fetched_at, string_count, blob_size = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or field_count != SNAPSHOT_FIELD_COUNT:
+            raise ValueError(f"Unsupported leaderboard snapshot file {path}")
+        position = SNAPSHOT_HEADER.size
+
+        offsets = array("I")
+        offsets.frombytes(data[position:position + 4 * (string_count + 1)])
+        position += 4 * (string_count + 1)
+        blob = data[position:position + blob_size]
+        position += blob_size
+        strings = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(string_count)]
+
+        boards = []
+        for is_hardcore in (False, True):
+            (record_count,) = struct.unpack_from("<I", data, position)
+            position += 4
+            records = array("I")
+            records.frombytes(data[position:position + 4 * record_count * field_count])
+            position += 4 * record_count * field_count
+
+            characters = []
+            for start in range(0, len(records), field_count):
+                character_id, name, stance, trinket_mod, goblet_mod, horn_mod, rupture_level, level, rating, deaths = records[start:start + field_count]
+                characters.append(CharacterRecord(
+                    strings[character_id], strings[name], rupture_level, level, rating, deaths, is_hardcore,
+                    strings[stance], strings[trinket_mod], strings[goblet_mod], strings[horn_mod],
+                ))
+            boards.append(characters)
+
+    return LeaderboardSnapshot(boards[0], boards[1], fetched_at=fetched_at)
+
+
+def seed_leaderboard_snapshot():
+    if not os.path.exists(LEADERBOARD_SNAPSHOT_PATH):
+        return None
+    snapshot = read_snapshot_file()
+    return snapshot, max(0.0, time.time() - snapshot.fetched_at)
+
+
+def prefetch_leaderboard_snapshot():
+    """
+    Fetches both leaderboards, stores them in the in-process cache and persists them to
+    LEADERBOARD_SNAPSHOT_PATH for cold instances to start from.
+    """
+    snapshot = load_leaderboard_snapshot()
+    leaderboard_cache.put(snapshot)
+    write_snapshot_file(snapshot)
+    logging.info(f"Wrote leaderboard snapshot to {LEADERBOARD_SNAPSHOT_PATH}")
+
+
+leaderboard_cache = SnapshotCache("leaderboard", load_leaderboard_snapshot, LEADERBOARD_CACHE_TTL, LEADERBOARD_CACHE_MAX_STALE, seed=seed_leaderboard_snapshot)
+
+
+# ----------------------------------------------------------------------------
+# ------------------------- LEADERBOARD CHANGE FEED --------------------------
+# ----------------------------------------------------------------------------
+
+@dataclass(slots=True)
+class LeaderboardChange:
+    """One change between two leaderboard snapshots. `kind` is "rank", "rupture" or "death"."""
+    leaderboard_type: str
+    name: str
+    kind: str
+    old: object
+    new: object
+
+    def describe(self):
+        if self.kind == "rank":
+            return f"{self.name} moved from #{self.old} to #{self.new} ({self.leaderboard_type})"
+        if self.kind == "rupture":
+            return f"{self.name} reached rupture {self.new}, up from {self.old} ({self.leaderboard_type})"
+        return f"{self.name} died ({self.leaderboard_type})"
+
+
+def diff_leaderboards(previous, current):
+    """
+    Compares two LeaderboardSnapshots by character id in O(n) and returns the rank changes,
+    rupture level increases and hardcore deaths (deaths going from 0 to anything else).
+    Characters that are on only one of the boards are ignored.
+    """
+    changes = []
+    for leaderboard_type, characters in current.boards.items():
+        previous_by_id = {character.id: (ranking, character) for ranking, character in enumerate(previous.boards.get(leaderboard_type, []), start=1)}
+        for ranking, character in enumerate(characters, start=1):
+            before = previous_by_id.get(character.id)
+            if before is None:
+                continue
+            previous_ranking, previous_character = before
+            if previous_ranking != ranking:
+                changes.append(LeaderboardChange(leaderboard_type, character.name, "rank", previous_ranking, ranking))
+            if character.rupture_level > previous_character.rupture_level:
+                changes.append(LeaderboardChange(leaderboard_type, character.name, "rupture", previous_character.rupture_level, character.rupture_level))
+            if leaderboard_type == "Hardcore" and previous_character.deaths == 0 and character.deaths != 0:
+                changes.append(LeaderboardChange(leaderboard_type, character.name, "death", previous_character.deaths, character.deaths))
+    return changes
+
+
+def top_changes(changes, per_kind):
+    """
+    The first `per_kind` deaths and rupture records and the `per_kind` biggest rank moves, which
+    are all format_leaderboard_changes can pick from as long as its limit is at most `per_kind`.
+    """
+    deaths = [change for change in changes if change.kind == "death"][:per_kind]
+    ruptures = [change for change in changes if change.kind == "rupture"][:per_kind]
+    moves = heapq.nlargest(per_kind, (change for change in changes if change.kind == "rank"), key=lambda change: abs(change.new - change.old))
+    return deaths + ruptures + moves
+
+
+class LeaderboardChangeFeed:
+    """
+    Keeps the top `per_kind` changes of each kind from the last `history` leaderboard refreshes
+    for the summary, and the changes of up to `players` players (by base name) for looking up a
+    single player. A player's moves in refreshes that follow each other within that history add up
+    to one change per character and kind.
+    With `collect_unposted` set it also keeps up to `unposted_max` changes not yet posted to the
+    watch channel. Fed by a listener on the leaderboard cache, so each refresh is diffed once no
+    matter how many players ask for it.
+    """
+
+    def __init__(self, history=20, per_kind=LEADERBOARD_CHANGES_PER_KIND, collect_unposted=False, unposted_max=LEADERBOARD_UNPOSTED_MAX,
+                 players=LEADERBOARD_WATCH_PLAYERS):
+        self.per_kind = per_kind
+        self.collect_unposted = collect_unposted
+        self.diffs = deque(maxlen=history)
+        self.unposted = deque(maxlen=unposted_max)
+        self.players = players
+        # base name -> (time of the last refresh that changed the player, their changes)
+        self.by_player = OrderedDict()
+        self._lock = threading.Lock()
+
+    def on_refresh(self, previous, current):
+        if previous is None or current is None:
+            return
+        changes = diff_leaderboards(previous, current)
+        kept = top_changes(changes, self.per_kind)
+        with self._lock:
+            self.diffs.append((current.fetched_at, kept))
+            if self.collect_unposted:
+                self.unposted.extend(kept)
+            since = self.diffs[0][0]
+            for change in changes:
+                self._remember(change, current.fetched_at, since)
+            while len(self.by_player) > self.players:
+                self.by_player.popitem(last=False)
+        logging.info(f"Leaderboard refresh produced {len(changes)} changes, kept {len(kept)}")
+
+    def _remember(self, change, fetched_at, since):
+        base_name = change.name.split()[0].lower()
+        last_changed, changes = self.by_player.pop(base_name, (None, []))
+        if last_changed is not None and last_changed < since:
+            changes = []
+        for index, earlier in enumerate(changes):
+            if (earlier.leaderboard_type, earlier.name, earlier.kind) == (change.leaderboard_type, change.name, change.kind):
+                # Report the whole move since the player started moving, and nothing once they are back where they were
+                if change.kind == "death":
+                    changes[index] = change
+                elif earlier.old == change.new:
+                    del changes[index]
+                else:
+                    changes[index] = LeaderboardChange(change.leaderboard_type, change.name, change.kind, earlier.old, change.new)
+                break
         else:
+            changes.append(change)
+        self.by_player[base_name] = (fetched_at, changes)
+
+    def recent(self, username=None):
+        with self._lock:
+            if not username:
+                return [change for _, diff in self.diffs for change in diff]
+            if not self.diffs:
+                return []
+            last_changed, changes = self.by_player.get(username.lower(), (0.0, []))
+            return list(changes) if last_changed >= self.diffs[0][0] else []
+
+    def take_unposted(self):
+        with self._lock:
+            changes = list(self.unposted)
+            self.unposted.clear()
+        return changes
+
+
+# Only instances that can post to the watch channel gather changes for it
+leaderboard_changes = LeaderboardChangeFeed(collect_unposted=bool(DISCORD_BOT_TOKEN and LEADERBOARD_WATCH_CHANNEL_ID))
+leaderboard_cache.add_listener(leaderboard_changes.on_refresh)
+
+
+def format_leaderboard_changes(changes, limit=20):
+    """
+    Formats changes for a message: deaths first, then rupture records, then the biggest rank
+    moves. Every climb shifts everyone below it by one, so at most `limit` lines are shown.
+    """
+    deaths = [change for change in changes if change.kind == "death"]
+    ruptures = [change for change in changes if change.kind == "rupture"]
+    moves = sorted((change for change in changes if change.kind == "rank"), key=lambda change: abs(change.new - change.old), reverse=True)
+    return "\n".join(change.describe() for change in (deaths + ruptures + moves)[:limit])
+
+
+def watch_leaderboard(username=None):
+    changes = leaderboard_changes.recent(username)
+    if not changes:
+        return f"No recent leaderboard changes for '{username}'." if username else "No recent leaderboard changes."
+    return f"**Recent leaderboard changes**\n{format_leaderboard_changes(changes)}"
+
+
+def post_leaderboard_changes():
+    """Posts the changes gathered since the last post to LEADERBOARD_WATCH_CHANNEL_ID, if configured."""
+    changes = leaderboard_changes.take_unposted()
+    if not changes or not (DISCORD_BOT_TOKEN and LEADERBOARD_WATCH_CHANNEL_ID):
+        return
+    message = format_leaderboard_changes(changes)
+    if not message:
+        return
+    channel = f"/channels/{LEADERBOARD_WATCH_CHANNEL_ID}/messages"
+    for chunk in split_message(message):
+        discord_dispatcher.request("POST", f"POST {channel}", channel, time.monotonic() + 60,
+                                   json={"content": chunk}, headers={"Authorization": f"Bot {DISCORD_BOT_TOKEN}"})
+
+
+RUPTURE_SHEET_RANGE = "Rupture Boss Chest Calculated Data!A1:H"
+TIME_ESSENCE_PER_BEETLE = 100
+DEFAULT_REROLL_COST = 1500
+# The bounds Discord enforces on /rupturecalc's rerollcost option (discord_commands.yaml)
+MIN_REROLL_COST = 150
+MAX_REROLL_COST = 5000
+# /ruptureplan shows at most this many levels (every Nth level of a wider range, fewer when wide columns
+# would not fit in one message) and reroll costs
+RUPTURE_PLAN_MAX_ROWS = 30
+RUPTURE_PLAN_MAX_COSTS = 4
+REROLL_COST_SEPARATORS = re.compile(r"[\s,]+")
+
+
+def runs_per(amount, per_run):
+    """Runs needed to gather `amount` at `per_run` a run, to two decimals; NaN when a run yields nothing."""
+    return round(amount / per_run, 2) if per_run else math.nan
+
+
+class RuptureTable:
+    """
+    The rupture sheet as typed column arrays sorted by level, with the per-level time essence
+    arithmetic done once. A level range is a slice, so a planning grid is computed a column at a time.
+    """
+
+    def __init__(self, rows):
+        rows = sorted(rows)
+        self.level = array("I", (level for level, _, _ in rows))
+        self.craftmat_avg = array("I", (craftmat_avg for _, craftmat_avg, _ in rows))
+        self.time_essence = array("I", (time_essence for _, _, time_essence in rows))
+        self.runs_for_beetle = array("d", (runs_per(TIME_ESSENCE_PER_BEETLE, time_essence) for time_essence in self.time_essence))
+
+    def __len__(self):
+        return len(self.level)
+
+    def __contains__(self, level):
+        index = bisect.bisect_left(self.level, level)
+        return index < len(self.level) and self.level[index] == level
+
+    def plan(self, low, high, rerollcosts):
+        """
+        Computes the runs per beetle and the runs per reroll at each cost for every level from
+        `low` to `high` (inclusive) in the sheet.
+
+        Returns:
+            RupturePlan: The grid, with one runs per reroll column per cost.
+        """
+        span = slice(bisect.bisect_left(self.level, low), bisect.bisect_right(self.level, high))
+        craftmat_avg = self.craftmat_avg[span]
+        return RupturePlan(
+            levels=self.level[span],
+            craftmat_avg=craftmat_avg,
+            time_essence=self.time_essence[span],
+            runs_for_beetle=self.runs_for_beetle[span],
+            rerollcosts=tuple(rerollcosts),
+            runs_for_reroll=[array("d", (runs_per(rerollcost, per_run) for per_run in craftmat_avg)) for rerollcost in rerollcosts],
+        )
+
+
+@dataclass
+class RupturePlan:
+    levels: array
+    craftmat_avg: array
+    time_essence: array
+    runs_for_beetle: array
+    rerollcosts: tuple
+    runs_for_reroll: list
+
+    @staticmethod
+    def most_efficient(yields):
+        """
+        The index of the level with the highest yield per run in `yields`, so the fewest runs for
+        anything (the lowest such level), or None when no level yields anything. Runs scale with the
+        amount needed, so the same level is the most efficient whatever the reroll cost.
+        """
+        best = max(range(len(yields)), key=lambda index: (yields[index], -index), default=None)
+        return best if best is not None and yields[best] else None
+
+
+def load_rupture_table():
+    """Fetches the rupture sheet and parses it into a RuptureTable."""
+    spreadsheet_url = f"{SHEETS_API_URL}/v4/spreadsheets/{GOOGLE_API_SPREADSHEET_ID}/values/{RUPTURE_SHEET_RANGE}?key={GOOGLE_API_KEY}"
+    result = sheets_upstream.get(spreadsheet_url)
+    result.raise_for_status()
+    values = result.json().get("values", [])
+
+    rows = {}
+    for row in values[1:]:
+        try:
+            level, craftmat_avg, time_essence = int(row[0]), int(row[3]), int(row[5])
+        except (IndexError, ValueError):
+            logging.debug(f"Skipping rupture sheet row {row}")
+            continue
+        rows[level] = (level, craftmat_avg, time_essence)
+    return RuptureTable(rows.values())
+
+
+rupture_table_cache = SnapshotCache("rupture table", load_rupture_table, RUPTURE_CACHE_TTL, RUPTURE_CACHE_MAX_STALE)
+
+
+def get_rupture_table():
+    """The cached rupture table, or the message to answer with when there is none."""
+    table = rupture_table_cache.get()
+    if table is None:
+        return None, reply_failed("Failed to retrieve rupture data.")
+    if not table:
+        logging.warning("No data found in sheet.")
+        return None, "No data found in sheet."
+    return table, None
+
+
+def format_runs(runs):
+    return "n/a" if math.isnan(runs) else f"{math.ceil(runs)} ({runs})"
+
+
+@timed("rupturecalc")
+def rupturecalc(rupturelevel, rerollcost):
+    try:
+        table, message = get_rupture_table()
+        if table is None:
+            return message
+
+        if rupturelevel not in table:
             logging.warning(f"Rupture level {rupturelevel} not found in the spreadsheet.")
             return f"Rupture level {rupturelevel} not found in the spreadsheet."
-            
-    except requests.HTTPError as httperr:
-        logging.error(f"HTTP error occurred: {httperr}")
-        return f"HTTP error occurred: {httperr}"
+
+        plan = table.plan(rupturelevel, rupturelevel, (rerollcost,))
+
+        content = (
+            f"Rupture Level {rupturelevel}\n"
+            f"Runs per Beetle: {format_runs(plan.runs_for_beetle[0])}.\n"
+            f"Runs per reroll given cost {rerollcost}: {format_runs(plan.runs_for_reroll[0][0])}"
+        )
+
+        return content
+
     except Exception as e:
         logging.error(f"Error occurred in rupturecalc: {e}")
-        return f"Error occurred in rupturecalc: {e}"
-    
+        return reply_failed(f"Error occurred in rupturecalc: {e}")
+
+
+def parse_rerollcosts(rerollcosts):
+    """
+    Splits the `rerollcosts` option into distinct costs in the order given; raises ValueError on
+    anything but whole numbers from MIN_REROLL_COST to MAX_REROLL_COST.
+    """
+    costs = []
+    for cost in REROLL_COST_SEPARATORS.split(rerollcosts.strip()):
+        if not cost:
+            continue
+        if not cost.isdigit() or not MIN_REROLL_COST <= int(cost) <= MAX_REROLL_COST:
+            raise ValueError(f"{cost} is not a reroll cost")
+        if int(cost) not in costs:
+            costs.append(int(cost))
+    return costs
+
+
+@timed("ruptureplan")
+def ruptureplan(fromlevel, tolevel, rerollcosts):
+    """
+    Plans runs over a range of rupture levels for several reroll costs at once.
+
+    Args:
+        fromlevel (int): The first rupture level of the range.
+        tolevel (int): The last rupture level of the range.
+        rerollcosts (list): The reroll costs to compare.
+
+    Returns:
+        str: A table of the runs per beetle and per reroll at each cost, with the most efficient levels in the range.
+    """
+    table, message = get_rupture_table()
+    if table is None:
+        return message
+
+    low, high = sorted((fromlevel, tolevel))
+    skipped = rerollcosts[RUPTURE_PLAN_MAX_COSTS:]
+    rerollcosts = rerollcosts[:RUPTURE_PLAN_MAX_COSTS] or [DEFAULT_REROLL_COST]
+    with stage("rupture_grid"):
+        plan = table.plan(low, high, rerollcosts)
+    if not plan.levels:
+        return f"No rupture levels from {low} to {high} found in the spreadsheet."
+
+    with stage("format"):
+        summary = ""
+        beetle = plan.most_efficient(plan.time_essence)
+        if beetle is not None:
+            summary += f"Fewest runs per Beetle: level {plan.levels[beetle]}, {format_runs(plan.runs_for_beetle[beetle])}.\n"
+        reroll = plan.most_efficient(plan.craftmat_avg)
+        if reroll is not None:
+            summary += f"Fewest runs per reroll: level {plan.levels[reroll]}, " + ", ".join(
+                f"{format_runs(column[reroll])} at cost {cost}" for cost, column in zip(plan.rerollcosts, plan.runs_for_reroll)) + ".\n"
+        if skipped:
+            summary += f"Only the first {RUPTURE_PLAN_MAX_COSTS} reroll costs were planned; skipped {len(skipped)}.\n"
+
+        header = ("Level", "Beetle") + tuple(f"Reroll {cost}" for cost in plan.rerollcosts)
+        columns = [plan.runs_for_beetle] + plan.runs_for_reroll
+        cells = lambda index: (str(plan.levels[index]),) + tuple("n/a" if math.isnan(column[index]) else str(math.ceil(column[index])) for column in columns)
+        # Size the table by the widest line any level of the range could give, so that the title,
+        # the table and the summary always fit in one message
+        widths = [max(map(len, column)) for column in zip(header, *map(cells, range(len(plan.levels))))]
+        line_length = sum(widths) + 2 * (len(widths) - 1)
+        longest_title = f"Runs needed, rupture {low} to {high} (every {len(plan.levels)} levels)\n"
+        room = DISCORD_MESSAGE_LIMIT - len(longest_title) - len("```\n") - line_length - len("\n```\n") - len(summary)
+        max_rows = max(1, min(RUPTURE_PLAN_MAX_ROWS, room // (line_length + 1)))
+
+        step = math.ceil(len(plan.levels) / max_rows)
+        rows = [cells(index) for index in range(0, len(plan.levels), step)]
+        widths = [max(len(row[column]) for row in [header] + rows) for column in range(len(header))]
+        lines = ["  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in [header] + rows]
+        message = f"Runs needed, rupture {low} to {high}" + (f" (every {step} levels)" if step > 1 else "") + "\n"
+        message += "```\n" + "\n".join(lines) + "\n```\n" + summary
+    return message
+
+
+def ruptureplan_command(options):
+    """Dispatches /ruptureplan on its options."""
+    try:
+        rerollcosts = parse_rerollcosts(str(options.get("rerollcosts") or ""))
+    except ValueError as e:
+        return f"Reroll costs must be whole numbers from {MIN_REROLL_COST} to {MAX_REROLL_COST}, separated by commas or spaces: {e}."
+    fromlevel = options["fromlevel"]
+    return ruptureplan(fromlevel, options.get("tolevel", fromlevel), rerollcosts)
+
+
+@timed("get_user_characters")
 def get_user_characters(username: str):
-    # URLs for normal and hardcore leaderboards
-    softcore_url = "http://loadbalancer-e2a9b2a-1115437761.us-east-1.elb.amazonaws.com/leaderboards/scores?type=normal"
-    hardcore_url = "http://loadbalancer-e2a9b2a-1115437761.us-east-1.elb.amazonaws.com/leaderboards/scores?type=hardcore"
-
-    # Make requests to both URLs
-    softcore_response = requests.get(softcore_url)
-    hardcore_response = requests.get(hardcore_url)
-
-    username_lower = username.lower()
-
-    # Check if requests were successful
-    if softcore_response.status_code == 200 and hardcore_response.status_code == 200:
-        # Parse JSON responses
-        softcore_data = softcore_response.json()
-        hardcore_data = hardcore_response.json()
-
-        user_info_list = []
-        sc_ranking = 1
-        hc_ranking = 1
-
-        # Search for username in normal leaderboard
-        for leaderboard in softcore_data["leaderboards"]:
-            if str(leaderboard["name"].split()[0]).lower() == username_lower:
-                user_info_list.append({"leaderboard_type": "Softcore", "character_info": leaderboard, "ranking": sc_ranking})
-            sc_ranking += 1
-
-        # Search for username in hardcore leaderboard
-        for leaderboard in hardcore_data["leaderboards"]:
-            if str(leaderboard["name"].split()[0]).lower() == username_lower:
-                user_info_list.append({"leaderboard_type": "Hardcore", "character_info": leaderboard, "ranking": hc_ranking})
-            hc_ranking += 1
-
-        if user_info_list:
-            return user_info_list
-        else:
-            return f"No characters found for user '{username}' in leaderboards."
+    snapshot = leaderboard_cache.get()
+    if snapshot is None:
+        return reply_failed("Failed to retrieve leaderboard data.")
+
+    with stage("leaderboard_scan"):
+        user_info_list = snapshot.lookup(username)
+    if user_info_list:
+        return user_info_list
     else:
-        return "Failed to retrieve leaderboard data."
-    
+        return f"No characters found for user '{username}' in leaderboards."
 
-    
+
+@timed("format")
 def format_character_info_base(highest_characters):
-    highest_characters_sorted = sorted(highest_characters, key=lambda x: int(x["character_info"]["raptureLevel"]), reverse=True)
+    highest_characters_sorted = sorted(highest_characters, key=lambda x: x["character_info"].rupture_level, reverse=True)
+    offhands = classify_offhands(character["character_info"] for character in highest_characters_sorted)
     message = ""
-    for character in highest_characters_sorted:
-        build = character["character_info"]["build"]
-        offhand = get_offhand_type(build["trinketMod"], build["gobletMod"], build["hornMod"])
+    for character, offhand in zip(highest_characters_sorted, offhands):
+        character_info = character["character_info"]
         if character["leaderboard_type"] == "Hardcore":
-            if character["character_info"]["deaths"] == "0":
+            if character_info.deaths == 0:
                 alive_status = "Alive"
             else:
                 alive_status = "Dead"
-            message += f"""**Name:** {character["character_info"]["name"]}
-**Highest Rupture:** {character["character_info"]["raptureLevel"]}
-**Level:** {character["character_info"]["level"]}
+            message += f"""**Name:** {character_info.name}
+**Highest Rupture:** {character_info.rupture_level}
+**Level:** {character_info.level}
 **Offhand:** {offhand if offhand else "Unknown"}
-**Ranking:** {character["ranking"]}
+**Ranking:** {character["ranking"]}{format_percentile(character)}
 **Leaderboard:** {character["leaderboard_type"]}
 **Status:** {alive_status}
 \n"""
         else:
-            message += f"""**Name:** {character["character_info"]["name"]}
-**Highest Rupture:** {character["character_info"]["raptureLevel"]}
-**Level:** {character["character_info"]["level"]}
+            message += f"""**Name:** {character_info.name}
+**Highest Rupture:** {character_info.rupture_level}
+**Level:** {character_info.level}
 **Offhand:** {offhand if offhand else "Unknown"}
-**Deaths:** {character["character_info"]["deaths"]}
-**Ranking:** {character["ranking"]}
+**Deaths:** {character_info.deaths}
+**Ranking:** {character["ranking"]}{format_percentile(character)}
 **Leaderboard:** {character["leaderboard_type"]}
 \n"""
     return message
 
+def format_percentile(character):
+    if not character.get("board_size"):
+        return ""
+    return f" (top {100.0 * character['ranking'] / character['board_size']:.1f}%)"
+
+
+def leaderboard_rank_for_rupture(rupture_level):
+    snapshot = leaderboard_cache.get()
+    if snapshot is None:
+        return reply_failed("Failed to retrieve leaderboard data.")
+    lines = [f"**Rupture {rupture_level}** would rank:"]
+    for leaderboard_type, columns in snapshot.columns.items():
+        ranking = columns.rank_for_rupture(rupture_level)
+        lines.append(f"**{leaderboard_type}:** #{ranking} of {len(columns)} (top {columns.percentile(ranking):.1f}%)")
+    return "\n".join(lines)
+
+
+def leaderboard_top_alive_hardcore(count):
+    snapshot = leaderboard_cache.get()
+    if snapshot is None:
+        return reply_failed("Failed to retrieve leaderboard data.")
+    top = snapshot.columns["Hardcore"].top_alive_hardcore(count)
+    if not top:
+        return "No alive hardcore characters found."
+    lines = [f"**Top {len(top)} alive hardcore characters by rating**"]
+    lines += [f"{position}. {character.name} - Rating {character.rating}, Rupture {character.rupture_level}" for position, character in enumerate(top, start=1)]
+    return "\n".join(lines)
+
+
+def leaderboard_stance_counts():
+    snapshot = leaderboard_cache.get()
+    if snapshot is None:
+        return reply_failed("Failed to retrieve leaderboard data.")
+    lines = []
+    for leaderboard_type, columns in snapshot.columns.items():
+        counts = ", ".join(f"{stance or 'Unknown'}: {count}" for stance, count in columns.count_per_stance().items())
+        lines.append(f"**{leaderboard_type}:** {counts}")
+    return "\n".join(lines)
+
+
+def leaderboard_command(options):
+    """Dispatches /leaderboard on its options; without any it links the leaderboard site."""
+    if options.get("rupture") is not None:
+        return leaderboard_rank_for_rupture(options["rupture"])
+    if options.get("top") is not None:
+        return leaderboard_top_alive_hardcore(options["top"])
+    if options.get("stances"):
+        return leaderboard_stance_counts()
+    if options.get("users"):
+        return leaderboard_batch_lookup(parse_usernames(options["users"]))
+    if options.get("user"):
+        return leaderboard_lookup(options["user"])
+    return "[Leaderboard](https://dwarvenleaderboard.com/)"
+
+
+def autocomplete_choices(interaction):
+    """
+    Answers an autocomplete interaction from the cached leaderboard without waiting on the
+    network; Discord drops answers that take longer than 3 seconds.
+    """
+    focused = next((option for option in interaction.get("data", {}).get("options", []) if option.get("focused")), None)
+    if focused is None or focused.get("name") != "user":
+        return []
+    snapshot = leaderboard_cache.get_nowait()
+    if snapshot is None:
+        return []
+    return [{"name": name, "value": name} for name in snapshot.complete(str(focused.get("value", "")))]
+
+
 def format_item_details(item):
     details = ""
     for key, value in item.items():
         details += f"**{key}:** {value}\n"
     return details
 
+OFFHANDS = ["Arcane Apocalypse","Chain Lightning","Spinning Blade","Eye of the Storm","Lightning Plasma","Delusions of Zelkor","Vortex","Dragon Flames","Ferocity of Wolves","Fire Orb","Arcane Orb","Carnage of Fire","Cracked Arcane Seed","Starblades","Fire Totem","Lightning Totem","Toxicity","Burning Shield","Rain of Fire","Electric Dragons","Arcane Totem","Blood Dragons","Fire Beam","Death Blades","Spark"]
+OFFHAND_BY_LOWER = {offhand.lower(): offhand for offhand in OFFHANDS}
+OFFHAND_ORDER = {offhand: position for position, offhand in enumerate(OFFHANDS)}
+# One scan finds every offhand mentioned in a mod. The lookahead lets matches overlap, so a mod
+# naming two offhands counts both, like the old per-offhand substring checks did.
+OFFHAND_PATTERN = re.compile("(?=(" + "|".join(re.escape(offhand) for offhand in sorted(OFFHAND_BY_LOWER, key=len, reverse=True)) + "))")
+
+
+@lru_cache(maxsize=4096)
 def get_offhand_type(trinketmod, gobletmod, hornmod):
-    offhands = ["Arcane Apocalypse","Chain Lightning","Spinning Blade","Eye of the Storm","Lightning Plasma","Delusions of Zelkor","Vortex","Dragon Flames","Ferocity of Wolves","Fire Orb","Arcane Orb","Carnage of Fire","Cracked Arcane Seed","Starblades","Fire Totem","Lightning Totem","Toxicity","Burning Shield","Rain of Fire","Electric Dragons","Arcane Totem","Blood Dragons","Fire Beam","Death Blades","Spark"]
-    
+    """
+    Returns the offhand named by at least two of the trinket, goblet and horn mods, or None.
+    Ties go to the offhand listed first in OFFHANDS.
+    """
     offhand_counts = {}
-    for offhand in offhands:
-        offhand_counts[offhand] = 0
+    for mod in (trinketmod, gobletmod, hornmod):
+        for offhand in {OFFHAND_BY_LOWER[match] for match in OFFHAND_PATTERN.findall(mod.lower())}:
+            offhand_counts[offhand] = offhand_counts.get(offhand, 0) + 1
+
+    matches = [offhand for offhand, count in offhand_counts.items() if count >= 2]
+    return min(matches, key=OFFHAND_ORDER.get) if matches else None
 
-    for mod in [trinketmod.lower(), gobletmod.lower(), hornmod.lower()]:
-        for offhand in offhands:
-            if offhand.lower() in mod:
-                offhand_counts[offhand] += 1
-    
-    for offhand, count in offhand_counts.items():
-        if count >= 2:
-            return offhand
-    
-    return None
 
+def classify_offhands(characters):
+    """
+    Classifies a whole leaderboard in one pass. Returns the offhand (or None) for each
+    CharacterRecord in `characters`, in order. Builds sharing a mod triple are classified once.
+    """
+    return [get_offhand_type(character.trinket_mod, character.goblet_mod, character.horn_mod) for character in characters]
 
 
-def leaderboard_lookup(username: str, info_details: str = None) -> str:
+
+def select_highest_characters(user_characters):
     """
-    Looks up the leaderboard information for a given username.
+    Picks a user's best characters from their leaderboard entries.
 
     Args:
-        username (str): The username to lookup.
-        info_details (str, optional): Additional information details. Defaults to None. (Not implemented)
+        user_characters (list): Entries as returned by `get_user_characters`.
 
     Returns:
-        str: The formatted character information.
+        tuple: The highest rupture softcore, highest rupture hardcore and highest rated alive
+        hardcore entry, each None when the user has no such character.
     """
-    user_characters = get_user_characters(username)
-    
     highest_hc = None
     highest_hc_alive = None
     highest_sc = None
     for character in user_characters:
-        if character["leaderboard_type"] == "Softcore" and (highest_sc is None or int(character["character_info"]["raptureLevel"]) > int(highest_sc["character_info"]["raptureLevel"])):
+        if character["leaderboard_type"] == "Softcore" and (highest_sc is None or character["character_info"].rupture_level > highest_sc["character_info"].rupture_level):
             highest_sc = character
         elif character["leaderboard_type"] == "Hardcore":
-            if highest_hc is None or int(character["character_info"]["raptureLevel"]) > int(highest_hc["character_info"]["raptureLevel"]):
+            if highest_hc is None or character["character_info"].rupture_level > highest_hc["character_info"].rupture_level:
                 highest_hc = character
-            if character["character_info"]["deaths"] == '0' and (highest_hc_alive is None or int(character["character_info"]["rating"]) > int(highest_hc_alive["character_info"]["rating"])):
+            if character["character_info"].deaths == 0 and (highest_hc_alive is None or character["character_info"].rating > highest_hc_alive["character_info"].rating):
                 highest_hc_alive = character
+    return highest_sc, highest_hc, highest_hc_alive
+
+
+def leaderboard_lookup(username: str, info_details: str = None) -> str:
+    """
+    Looks up the leaderboard information for a given username.
+
+    Args:
+        username (str): The username to lookup.
+        info_details (str, optional): Additional information details. Defaults to None. (Not implemented)
+
+    Returns:
+        str: The formatted character information.
+    """
+    user_characters = get_user_characters(username)
+    if isinstance(user_characters, str):
+        return user_characters
+
+    highest_sc, highest_hc, highest_hc_alive = select_highest_characters(user_characters)
 
     highest_characters = []
     if highest_sc:
         highest_characters.append(highest_sc)
-    if highest_hc and highest_hc_alive and highest_hc['character_info']['id'] == highest_hc_alive['character_info']['id']:
+    if highest_hc and highest_hc_alive and highest_hc['character_info'].id == highest_hc_alive['character_info'].id:
         highest_characters.append(highest_hc_alive)
         return format_character_info_base(highest_characters)
     if highest_hc:
@@ -305,90 +1907,349 @@ def leaderboard_lookup(username: str, info_details: str = None) -> str:
         return message
 
 
-def get_item_data(item_data):
-    # Parse the JSON object
-    parsed_data = json.loads(item_data)
+# Usernames in the `users` option are separated by commas and/or whitespace
+USERNAME_SEPARATORS = re.compile(r"[\s,]+")
+MAX_BATCH_USERS = 50
+
+
+def parse_usernames(users):
+    """Splits the `users` option into distinct usernames, keeping the first spelling of each."""
+    usernames = {}
+    for username in USERNAME_SEPARATORS.split(users):
+        if username:
+            usernames.setdefault(username.lower(), username)
+    return list(usernames.values())
+
+
+def format_batch_cell(character, template):
+    """Formats `template` with the entry's CharacterRecord and appends its ranking, or "-" without one."""
+    if character is None:
+        return "-"
+    return f"{template.format(character['character_info'])} #{character['ranking']}"
+
+
+@timed("leaderboard_batch_lookup")
+def leaderboard_batch_lookup(usernames):
+    """
+    Looks up several users against one leaderboard snapshot and renders one compact table.
+
+    Each user costs one index lookup, so a roster of N users is O(N) on top of building the
+    snapshot index once, instead of a board scan per user.
+
+    Args:
+        usernames (list): The usernames to lookup (caps insensitive).
+
+    Returns:
+        str: A table with each user's best softcore, hardcore and alive hardcore character.
+    """
+    if not usernames:
+        return "No usernames given. Separate several users with commas or spaces."
+    snapshot = leaderboard_cache.get()
+    if snapshot is None:
+        return reply_failed("Failed to retrieve leaderboard data.")
+
+    skipped = usernames[MAX_BATCH_USERS:]
+    rows = []
+    missing = []
+    with stage("leaderboard_scan"):
+        for username in usernames[:MAX_BATCH_USERS]:
+            user_characters = snapshot.lookup(username)
+            if not user_characters:
+                missing.append(username)
+                continue
+            highest_sc, highest_hc, highest_hc_alive = select_highest_characters(user_characters)
+            rows.append((
+                snapshot.display_names[username.lower()],
+                format_batch_cell(highest_sc, "R{0.rupture_level}"),
+                format_batch_cell(highest_hc, "R{0.rupture_level}"),
+                format_batch_cell(highest_hc_alive, "{0.rating}"),
+            ))
+
+    with stage("format"):
+        message = ""
+        if rows:
+            header = ("User", "Softcore", "Hardcore", "HC alive rating")
+            widths = [max(len(row[column]) for row in [header] + rows) for column in range(len(header))]
+            header_line, *lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in [header] + rows]
+            table = lambda block: "```\n" + "\n".join([header_line] + block) + "\n```\n"
+            # One table per message: each gets the header and stays within the message limit
+            block = []
+            for line in lines:
+                if block and len(table(block + [line])) > DISCORD_MESSAGE_LIMIT:
+                    message += table(block)
+                    block = []
+                block.append(line)
+            message += table(block)
+        if missing:
+            message += f"No characters found for: {', '.join(missing)}\n"
+        if skipped:
+            message += f"Only the first {MAX_BATCH_USERS} users were looked up; skipped {len(skipped)}.\n"
+    return message
+
 
-    # Extracting ParsedText
-    parsed_text = parsed_data["ParsedResults"][0]["ParsedText"]
+@dataclass
+class ItemRecord:
+    """An item read from an item screenshot. Stat names map to their "+" values, in tooltip order."""
+    name: str = ""
+    level: str = None
+    equipment_type: str = None
+    stats: dict = field(default_factory=dict)
+    mod: str = ""
 
-    # Splitting text into lines
-    lines = parsed_text.split('_BREAK_')
+    def to_display_dict(self):
+        details = {"Item Name": self.name, "Item Level": self.level}
+        if self.equipment_type != "Unknown":
+            details["Equipment Type"] = self.equipment_type
+        details.update(self.stats)
+        if self.mod:
+            details["Item Mod"] = self.mod
+        return details
 
-    # Initialize dictionary to store extracted data
-    extracted_data = {}
+
+def parse_item_text(parsed_text):
+    """
+    Parses `_BREAK_` delimited OCR text of an item tooltip in a single pass.
+
+    The tooltip lists the item name, its item level, an optional "Equipment:" line, then the stat
+    names followed by their "+" values in the same order, and finally the item mod. Stat names wait
+    in a queue until their value arrives; once every stat has a value the rest is the mod.
+    """
+    has_equipment_line = "Equipment:" in parsed_text
+    record = ItemRecord()
+    name_parts = []
+    mod_parts = []
+    pending_stats = deque()
     data_started = False
     data_ended = False
-    stat_count = 0
-    stat_match_count = 0
-    item_level = None
-    equipment_type = None
-    item_name = ''
-    item_mod = ''
-
-    # Iterate through each line and extract required information
-    for line in lines:
+
+    for line in parsed_text.split('_BREAK_'):
         line = line.title()
-        logging.critical(line)
-        if stat_count == stat_match_count and stat_count != 0:
-            logging.debug(f"Data ended {line}")
+        if record.stats and not pending_stats:
             data_ended = True
         if "Item Level" in line:
-            logging.debug(f"Item level found {line}")
-            item_level = line.split(' ')[-1]
-            if not "Equipment:" in parsed_text:
-                logging.debug("Equipment not found")
-                equipment_type = "Unknown"
+            record.level = line.split(' ')[-1]
+            if not has_equipment_line:
+                record.equipment_type = "Unknown"
                 data_started = True
-        elif not item_level:
-            logging.debug(f"Item name {line}")
-            item_name += f"{line} "
+        elif not record.level:
+            name_parts.append(line)
         elif "Equipment" in line:
-            logging.debug(f"Equipment found {line}")
-            equipment_type = line.split(':')[-1].strip()
+            record.equipment_type = line.split(':')[-1].strip()
             data_started = True
-            continue
-        elif data_started and not '+' in line and not data_ended:
-            logging.debug(f"Stat line {line}")
-            extracted_data[line] = ''
-            stat_count += 1
-        elif data_started and '+' in line and not data_ended:
-            logging.debug(f"Stat match found {line}")
-            stat_match_count += 1
-            extracted_data[list(extracted_data.keys())[stat_match_count-1]] = line
+        elif data_started and not data_ended and '+' not in line:
+            record.stats[line] = ''
+            pending_stats.append(line)
+        elif data_started and not data_ended and pending_stats:
+            record.stats[pending_stats.popleft()] = line
         else:
-            item_mod += f"{line} "
+            mod_parts.append(line)
 
-    # Add item level and equipment type to extracted data
-    extracted_data["Item Level"] = item_level
-    extracted_data["Equipment Type"] = equipment_type
-    extracted_data["Item Name"] = item_name.strip()
-    extracted_data["Item Mod"] = item_mod.strip()
-    
-    stat_counter = 0
+    record.name = " ".join(name_parts).strip()
+    record.mod = " ".join(mod_parts).strip()
+    return record
 
-    ordered_data = {}
-    ordered_data["Item Name"] = extracted_data["Item Name"]
-    ordered_data["Item Level"] = extracted_data["Item Level"]
-    if extracted_data["Equipment Type"] != "Unknown":
-        ordered_data["Equipment Type"] = extracted_data["Equipment Type"]
 
-    for key, value in extracted_data.items():
-        if stat_counter == stat_count:
-            break
-        ordered_data[key] = value
-        stat_counter += 1
+def parse_item_response(item_data):
+    """Parses an OCR.space response body (with line breaks replaced by `_BREAK_`) into an ItemRecord."""
+    return parse_item_text(json.loads(item_data)["ParsedResults"][0]["ParsedText"])
+
+
+def parse_item_batch(item_data_list):
+    """Parses many stored OCR responses at once; returns an ItemRecord per response, in order."""
+    return [parse_item_response(item_data) for item_data in item_data_list]
+
 
-    if extracted_data['Item Mod'] != '':
-        ordered_data["Item Mod"] = extracted_data["Item Mod"]
+@timed("get_item_data")
+def get_item_data(item_data):
+    return parse_item_response(item_data).to_display_dict()
+
+
+DISCORD_MESSAGE_LIMIT = 2000
+DISCORD_EPOCH_MS = 1420070400000
+# Interaction tokens can be used for 15 minutes after the interaction was created
+INTERACTION_TOKEN_LIFETIME = 15 * 60
+DISCORD_TIMEOUT = (3.05, 10)
+
+
+class DiscordDeadlineExceeded(Exception):
+    pass
+
+
+class DiscordDispatcher:
+    """
+    Sends requests to the Discord API over the shared pooled session while respecting its rate limits.
+
+    Rate limit buckets are learned from the X-RateLimit-* response headers and tracked per route
+    (method plus webhook, Discord's major parameter). A request waits when its bucket is empty,
+    a 429 is retried after its `retry_after`, and 5xx responses and connection errors are retried
+    with exponential backoff, all as long as the caller's deadline allows. Every route is a new
+    interaction token, so buckets are forgotten (at most every `prune_interval` seconds) once their
+    reset has passed, along with the routes pointing at them.
+    """
+
+    def __init__(self, base_url, max_attempts=5, prune_interval=1.0):
+        self.base_url = base_url
+        self.max_attempts = max_attempts
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._route_buckets = {}
+        self._buckets = {}
+        self._global_reset_at = 0.0
+        self._next_prune = 0.0
+
+    @property
+    def session(self):
+        return get_http_session()
+
+    def request(self, method, route, path, deadline, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            self._wait(self._blocked_until(route), deadline)
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", timeout=DISCORD_TIMEOUT, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                if attempt == self.max_attempts:
+                    raise
+                logging.warning(f"Discord request failed with {type(e).__name__}, retrying")
+                self._wait(time.monotonic() + self._backoff(attempt), deadline)
+                continue
+
+            self._update_bucket(route, response)
+            if attempt == self.max_attempts:
+                break
+            if response.status_code == 429:
+                retry_after = self._retry_after(response)
+                logging.warning(f"Rate limited on {method} request, retrying in {retry_after:.2f}s")
+                self._wait(time.monotonic() + retry_after, deadline)
+            elif response.status_code >= 500:
+                logging.warning(f"Discord returned {response.status_code} on {method} request, retrying")
+                self._wait(time.monotonic() + self._backoff(attempt), deadline)
+            else:
+                break
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(0.5 * 2 ** (attempt - 1), 8.0)
+
+    @staticmethod
+    def _wait(until, deadline):
+        delay = until - time.monotonic()
+        if delay <= 0:
+            return
+        if until > deadline:
+            raise DiscordDeadlineExceeded(f"Waiting {delay:.2f}s would pass the interaction token deadline")
+        time.sleep(delay)
+
+    def _blocked_until(self, route):
+        with self._lock:
+            blocked_until = self._global_reset_at
+            bucket = self._buckets.get(self._route_buckets.get(route))
+            if bucket and bucket[0] <= 0:
+                blocked_until = max(blocked_until, bucket[1])
+            return blocked_until
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.json().get("retry_after", 1.0))
+        except ValueError:
+            return float(response.headers.get("Retry-After", 1.0))
 
-    return ordered_data
+    def _update_bucket(self, route, response):
+        headers = response.headers
+        now = time.monotonic()
+        with self._lock:
+            if response.status_code == 429 and (headers.get("X-RateLimit-Global") or headers.get("X-RateLimit-Scope") == "global"):
+                self._global_reset_at = now + self._retry_after(response)
+            if now >= self._next_prune:
+                self._prune(now)
+            bucket_id = headers.get("X-RateLimit-Bucket")
+            if bucket_id is None:
+                return
+            self._route_buckets[route] = bucket_id
+            remaining = int(headers.get("X-RateLimit-Remaining", 1))
+            reset_after = float(headers.get("X-RateLimit-Reset-After", 0))
+            self._buckets[bucket_id] = (remaining, now + reset_after)
 
+    def _prune(self, now):
+        # A bucket past its reset is full again, which is what an unknown bucket is assumed to be
+        self._next_prune = now + self.prune_interval
+        self._buckets = {bucket_id: bucket for bucket_id, bucket in self._buckets.items() if bucket[1] > now}
+        self._route_buckets = {route: bucket_id for route, bucket_id in self._route_buckets.items() if bucket_id in self._buckets}
 
+
+discord_dispatcher = DiscordDispatcher(DISCORD_API_URL)
+
+
+CODE_FENCE = "```"
+
+
+def open_code_fence(content, end):
+    """
+    Returns the line that opened the ``` code block `content[:end]` ends inside (with its language,
+    if any), or None.
+    """
+    if content.count(CODE_FENCE, 0, end) % 2 == 0:
+        return None
+    start = content.rfind(CODE_FENCE, 0, end)
+    line_end = content.find("\n", start)
+    fence = content[start:line_end if line_end != -1 else len(content)]
+    # Only a language name may follow the backticks on the opening line; anything else is content
+    return fence if re.fullmatch(r"```[\w+-]{0,20}", fence) else CODE_FENCE
+
+
+def split_message(content, limit=DISCORD_MESSAGE_LIMIT):
+    """
+    Splits content into chunks of at most `limit` characters, preferring to break at newlines. A
+    ``` code block that does not fit in the rest of a chunk starts the next one; a block longer
+    than a whole chunk is closed at the end of the chunk and opened again in the next.
+    """
+    def cut_at(budget, after=0):
+        cut = content.rfind("\n", after + 1, budget)
+        return cut if cut > 0 else budget
+
+    closing = "\n" + CODE_FENCE
+    chunks = []
+    while len(content) > limit:
+        cut = cut_at(limit)
+        if open_code_fence(content, cut):
+            block_start = content.rfind(CODE_FENCE, 0, cut)
+            before_block = content.rfind("\n", 0, block_start)
+            if before_block > 0 and not open_code_fence(content, before_block):
+                cut = before_block
+            else:
+                # Leave room for the closing fence, and break after the line that opened the block
+                # so that every chunk holds some of it
+                opened = content.find("\n", block_start)
+                cut = cut_at(limit - len(closing), opened)
+        fence = open_code_fence(content, cut)
+        chunk, content = content[:cut], content[cut:].lstrip("\n")
+        if fence:
+            chunk += closing
+            content = f"{fence}\n{content}"
+        chunks.append(chunk)
+    chunks.append(content)
+    return chunks
+
+
+def interaction_deadline(request_body):
+    """Monotonic time at which the interaction's token expires, from the creation time in its snowflake id."""
+    try:
+        created_at = ((int(request_body["id"]) >> 22) + DISCORD_EPOCH_MS) / 1000
+    except (KeyError, TypeError, ValueError):
+        created_at = time.time()
+    return time.monotonic() + (created_at + INTERACTION_TOKEN_LIFETIME - time.time())
+
+
+@timed("send_discord_followup")
 def send_discord_followup(request_body, content):
     """
     Sends a follow-up message to a Discord channel.
 
+    The deferred original response is edited with the first 2000 characters; any remainder is
+    posted as additional follow-up messages.
+
     Args:
         request_body (dict): The request body containing the application ID and token.
         content (str): The content of the follow-up message.
@@ -399,46 +2260,335 @@ def send_discord_followup(request_body, content):
     try:
         logging.info("Starting to send Discord follow-up")
 
-        # Construct the URL for sending the follow-up message
-        url = f"https://discord.com/api/v10/webhooks/{request_body['application_id']}/{request_body['token']}/messages/@original"
-
-        # Define headers and body for the PATCH request
-        headers = {'Content-Type': 'application/json'}
-        body = json.dumps({"type": 4, "content": content})
+        webhook = f"/webhooks/{request_body['application_id']}/{request_body['token']}"
+        deadline = interaction_deadline(request_body)
+        chunks = split_message(content)
 
-        # Send the PATCH request to Discord API
-        response = requests.patch(url, headers=headers, data=body)
+        # Edit the deferred original response, then post the rest as follow-ups
+        response = discord_dispatcher.request("PATCH", f"PATCH {webhook}", f"{webhook}/messages/@original", deadline, json={"content": chunks[0]})
         logging.info(f"Response status code: {response.status_code}")
-        logging.info(f"Content: {content}")
-        logging.info(f"Body: {body}")
+        for chunk in chunks[1:]:
+            response = discord_dispatcher.request("POST", f"POST {webhook}", webhook, deadline, json={"content": chunk})
+            logging.info(f"Follow-up response status code: {response.status_code}")
+        logging.debug(f"Sent {len(content)} characters in {len(chunks)} message(s)")
 
-        # Check for HTTP errors
-        response.raise_for_status()
-
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, DiscordDeadlineExceeded) as e:
         logging.error(f"Error sending Discord follow-up: {e}")
         return f"Error sending Discord follow-up: {e}"
     
     
-def get_image_text(image_url):
-    ocr_url = "https://api.ocr.space/parse/image"
+@timed("get_image_text")
+def get_image_text(image_url, image_bytes=None):
+    """Runs OCR on the image at `image_url`, or on the PNG `image_bytes` (uploaded instead) when given."""
+    ocr_url = OCR_API_URL
                 
     payload={'language': 'eng',
     'isOverlayRequired': 'false',
-    'url': image_url,
     'iscreatesearchablepdf': 'false',
     'issearchablepdfhidetextlayer': 'false'}
     headers = {
     'apikey': OCR_API_KEY
     }
+    files = None
+    if image_bytes is None:
+        payload['url'] = image_url
+    else:
+        payload['filetype'] = 'PNG'
+        files = {'file': ('item.png', image_bytes, 'image/png')}
     
-    ocr_response = requests.post(ocr_url, headers=headers, data=payload)
+    ocr_response = ocr_upstream.post(ocr_url, headers=headers, data=payload, files=files)
     
     body = ocr_response.text.replace('\\r\\n', '_BREAK_')
     
     return body
-        
-        
+
+
+class OcrSpaceBackend:
+    """Reads screenshots with the OCR.space API."""
+
+    name = "ocrspace"
+
+    def read_text(self, image_url, image_bytes, preprocessed=None):
+        """
+        Returns the `_BREAK_` delimited text on the image. The preprocessed image is uploaded when
+        there is one, otherwise OCR.space downloads the image from `image_url` itself.
+        """
+        return json.loads(get_image_text(image_url, preprocessed))["ParsedResults"][0]["ParsedText"]
+
+
+class TesseractBackend:
+    """Reads screenshots with a local tesseract binary, running at most `workers` processes at once."""
+
+    name = "tesseract"
+
+    def __init__(self, command, workers, timeout):
+        self.command = command
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers)
+
+    def read_text(self, image_url, image_bytes, preprocessed=None):
+        """Returns the `_BREAK_` delimited text on the image, reading the preprocessed image when there is one."""
+        with self._slots:
+            result = subprocess.run([self.command, "stdin", "stdout", "-l", "eng"], input=preprocessed or image_bytes,
+                                    capture_output=True, timeout=self.timeout)
+        if result.returncode != 0:
+            raise RuntimeError(f"{self.command} exited with {result.returncode}: {result.stderr.decode(errors='replace').strip()}")
+        return tesseract_text(result.stdout.decode(errors="replace"))
+
+
+def tesseract_text(output):
+    """
+    Turns tesseract's stdout into `_BREAK_` delimited text shaped like OCR.space's ParsedText.
+
+    Tesseract separates paragraphs with blank lines, which the item parser would otherwise read as
+    stat names, so empty and whitespace-only lines are dropped and every other line ends in a break.
+    """
+    return "".join(f"{line}_BREAK_" for line in output.splitlines() if line.strip())
+
+
+_ocr_backend = None
+_ocr_backend_lock = threading.Lock()
+
+
+def get_ocr_backend():
+    """Returns the OCR engine configured by OCR_BACKEND."""
+    global _ocr_backend
+    with _ocr_backend_lock:
+        if _ocr_backend is None:
+            if OCR_BACKEND == "ocrspace":
+                _ocr_backend = OcrSpaceBackend()
+            elif OCR_BACKEND == "tesseract":
+                _ocr_backend = TesseractBackend(TESSERACT_COMMAND, TESSERACT_WORKERS, OCR_TIMEOUT)
+            else:
+                raise ValueError(f"Unknown OCR_BACKEND {OCR_BACKEND}")
+        return _ocr_backend
+
+
+# The tooltip is found as the largest solid area of TOOLTIP_CELL sized cells that are mostly
+# (TOOLTIP_DARK_SHARE) pixels darker than TOOLTIP_DARK_LEVEL
+TOOLTIP_CELL = 16
+TOOLTIP_DARK_LEVEL = 60
+TOOLTIP_DARK_SHARE = 0.6
+# Areas smaller than this share of the screenshot, or filling less of their bounding box, are not the tooltip
+TOOLTIP_MIN_AREA = 0.01
+TOOLTIP_MIN_FILL = 0.6
+
+
+def find_tooltip_box(gray):
+    """
+    Finds the item tooltip, a dark panel, in a grayscale screenshot: the largest solid dark area
+    that does not touch the screen edge.
+
+    Returns:
+        tuple: The (left, top, right, bottom) pixel box of the panel with one cell of margin, or
+        None when no area looks like a tooltip.
+    """
+    columns, rows = max(1, gray.width // TOOLTIP_CELL), max(1, gray.height // TOOLTIP_CELL)
+    # Averaging the dark pixel mask over each cell gives its dark share
+    dark = gray.point(lambda value: 255 if value < TOOLTIP_DARK_LEVEL else 0).resize((columns, rows), PIL_Image.BOX).tobytes()
+    threshold = 255 * TOOLTIP_DARK_SHARE
+    seen = bytearray(len(dark))
+    best = None
+    for start in range(len(dark)):
+        if seen[start] or dark[start] < threshold:
+            continue
+        seen[start] = 1
+        stack = [start]
+        count = 0
+        left, top, right, bottom = columns, rows, 0, 0
+        while stack:
+            cell = stack.pop()
+            count += 1
+            x, y = cell % columns, cell // columns
+            left, top, right, bottom = min(left, x), min(top, y), max(right, x), max(bottom, y)
+            for neighbour, inside in ((cell - 1, x > 0), (cell + 1, x < columns - 1), (cell - columns, y > 0), (cell + columns, y < rows - 1)):
+                if inside and not seen[neighbour] and dark[neighbour] >= threshold:
+                    seen[neighbour] = 1
+                    stack.append(neighbour)
+        fill = count / ((right - left + 1) * (bottom - top + 1))
+        if count < TOOLTIP_MIN_AREA * columns * rows or fill < TOOLTIP_MIN_FILL:
+            continue
+        # The tooltip floats over the game, areas running into the screen edge (HUD bars, dark
+        # scenery) only count when nothing else qualifies
+        rank = (left > 0 and top > 0 and right < columns - 1 and bottom < rows - 1, count)
+        if best is None or rank > best[0]:
+            best = (rank, (left, top, right, bottom))
+    if best is None:
+        return None
+    left, top, right, bottom = best[1]
+    return (max(0, (left - 1) * TOOLTIP_CELL), max(0, (top - 1) * TOOLTIP_CELL),
+            min(gray.width, (right + 2) * TOOLTIP_CELL), min(gray.height, (bottom + 2) * TOOLTIP_CELL))
+
+
+def otsu_threshold(histogram):
+    """The gray level that best separates the two classes of a 256 bin histogram (Otsu's method)."""
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background = weighted_background = 0
+    best_level, best_variance = 0, -1.0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def preprocess_item_image(image_bytes):
+    """
+    Turns an item screenshot into a small PNG for OCR: cropped to the tooltip, at most
+    OCR_IMAGE_MAX_WIDTH wide, and binarized to black text on white.
+    """
+    with PIL_Image.open(io.BytesIO(image_bytes)) as image:
+        gray = image.convert("L")
+    box = find_tooltip_box(gray)
+    if box is not None:
+        gray = gray.crop(box)
+    if gray.width > OCR_IMAGE_MAX_WIDTH:
+        gray = gray.resize((OCR_IMAGE_MAX_WIDTH, max(1, round(gray.height * OCR_IMAGE_MAX_WIDTH / gray.width))), PIL_Image.LANCZOS)
+
+    histogram = gray.histogram()
+    threshold = otsu_threshold(histogram)
+    # The more common side of the threshold is the panel, which becomes white
+    dark_background = sum(histogram[:threshold + 1]) > sum(histogram[threshold + 1:])
+    binary = gray.point(lambda value: 255 if (value <= threshold) == dark_background else 0, "1")
+
+    output = io.BytesIO()
+    binary.save(output, "PNG")
+    return output.getvalue()
+
+
+class OcrResultCache:
+    """
+    Content-addressed cache for OCR results, keyed by ocr_cache_key: the SHA-256 of the image
+    bytes and the OCR settings that read them.
+
+    Entries are JSON-serializable dicts. The newest `memory_entries` live in an in-memory LRU;
+    every entry is also written to `directory`, which is pruned (least recently used first, by
+    mtime) to stay under `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes, memory_entries):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        try:
+            with open(self._path(key), "r") as file:
+                value = json.load(file)
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(value, file)
+            os.replace(tmp_path, self._path(key))
+            self._prune()
+        except OSError as e:
+            logging.warning(f"Could not write OCR cache entry {key}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".json"):
+                    os.remove(entry.path)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+ocr_cache = OcrResultCache(OCR_CACHE_DIR, OCR_CACHE_MAX_BYTES, OCR_CACHE_MEMORY_ENTRIES)
+# Keyed by image hash, so the same screenshot posted several times at once is sent to OCR once
+ocr_flights = SingleFlight()
+
+
+def read_item_image(attachment_url):
+    """
+    Returns the parsed item data for an item screenshot. The image is downloaded and hashed first,
+    so a screenshot that was posted before skips the OCR request and the parsing.
+    """
+    with stage("image_download"):
+        image = attachment_upstream.get(attachment_url)
+        image.raise_for_status()
+    image_hash = hashlib.sha256(image.content).hexdigest()
+    cache_key = ocr_cache_key(image_hash)
+    return ocr_flights.do(cache_key, read_item_text, cache_key, image_hash, attachment_url, image.content)
+
+
+def ocr_cache_key(image_hash):
+    """The OCR engine and whether it reads the preprocessed image change the text, so both are part of the key."""
+    return f"{get_ocr_backend().name}-{'preprocessed' if OCR_PREPROCESS else 'original'}-{image_hash}"
+
+
+def read_item_text(cache_key, image_hash, attachment_url, image_bytes):
+    cached = ocr_cache.get(cache_key)
+    if cached is not None:
+        logging.info(f"OCR cache hit for image {image_hash}")
+        return cached["item"]
+
+    backend = get_ocr_backend()
+    preprocessed = None
+    if OCR_PREPROCESS:
+        with stage("image_preprocess"):
+            try:
+                preprocessed = preprocess_item_image(image_bytes)
+            except Exception as e:
+                logging.warning(f"Could not preprocess image {image_hash}, giving OCR the original instead: {e}")
+    with stage(f"ocr_{backend.name}"):
+        text = backend.read_text(attachment_url, image_bytes, preprocessed)
+    with stage("get_item_data"):
+        item_data = parse_item_text(text).to_display_dict()
+    ocr_cache.put(cache_key, {"text": text, "item": item_data})
+    return item_data
+
+
 def interact(raw_request):
     try:
         #logging.info("Processing body: %s", raw_request) #potentially sensitive
@@ -451,26 +2601,29 @@ def interact(raw_request):
 
             case "leaderboard":
                 try:
-                    data_options = data.get("options", [{}])
+                    data_options = data.get("options", [])
                     logging.debug(f"Data options: {data_options}")
-                    username = data_options[0].get("value", "")
-                    if len(data_options) > 1:
-                        info_details = data_options[1].get("value", None)
-                        message_content = leaderboard_lookup(username, info_details)
-                    else:
-                        message_content = leaderboard_lookup(username)
+                    message_content = leaderboard_command({option["name"]: option.get("value") for option in data_options})
                 except:
-                    message_content = "[Leaderboard](https://dwarvenleaderboard.com/)"
+                    message_content = reply_failed("[Leaderboard](https://dwarvenleaderboard.com/)")
 
             case "help":
                 try:
                     sub_command = data.get("options", [{}])[0].get("value", "")
                     if sub_command == "rupturecalc":
                         message_content = "Use `/rupturecalc` followed by the Rupture level and reroll cost to calculate the number of runs needed for the given level and cost."
+                    elif sub_command == "ruptureplan":
+                        message_content = "Use `/ruptureplan` with a range of Rupture levels and one or more reroll costs to compare the runs needed across the range and find the most efficient level."
+                    elif sub_command == "watch":
+                        message_content = "Use `/watch` to see recent rank moves, rupture records and hardcore deaths on the leaderboards, optionally for one user."
                     else:
-                        message_content = f"Available commands: `help`, `spreadsheet`, `rupturecalc`.\n\n"
+                        message_content = f"Available commands: `help`, `spreadsheet`, `rupturecalc`, `ruptureplan`, `watch`.\n\n"
                 except:
-                    message_content = f"Available commands: `help`, `spreadsheet`, `rupturecalc`.\n\n"
+                    message_content = f"Available commands: `help`, `spreadsheet`, `rupturecalc`, `ruptureplan`, `watch`.\n\n"
+
+            case "watch":
+                username = data.get("options", [{}])[0].get("value") if data.get("options") else None
+                message_content = watch_leaderboard(username)
 
             case "spreadsheet":
                 message_content = "[Rupture Spreadsheet](https://docs.google.com/spreadsheets/d/1rRO1LMt1NgykrdEfoZdEwhp4c9TRHTexYLuk6mgxLa0/edit#gid=0)"
@@ -478,10 +2631,13 @@ def interact(raw_request):
             case "rupturecalc":
                 rupturelevel = data.get("options", [{}])[0].get("value", "")
                 try:
-                    rerollcost = data.get("options", [{}])[1].get("value", 1500)
+                    rerollcost = data.get("options", [{}])[1].get("value", DEFAULT_REROLL_COST)
                 except:
-                    rerollcost = 1500
+                    rerollcost = DEFAULT_REROLL_COST
                 message_content = rupturecalc(rupturelevel, rerollcost)
+
+            case "ruptureplan":
+                message_content = ruptureplan_command({option["name"]: option.get("value") for option in data.get("options", [])})
             
             case "imagetest":
                 logging.debug("Image test command")
@@ -496,9 +2652,7 @@ def interact(raw_request):
                 
                 logging.debug(f"Attachment URL: {attachment_url}")
                 
-                body = get_image_text(attachment_url)
-
-                item_data = get_item_data(body)
+                item_data = read_item_image(attachment_url)
                 
                 logging.debug(item_data)
                 
@@ -511,12 +2665,110 @@ def interact(raw_request):
                 message_content = "Unknown command"
 
 
-        logging.info(f"Message content: {message_content}")
+        logging.debug(f"Message content: {message_content}")
         return message_content
 
     except Exception as e:
         logging.error(f"Error processing request: {e}")
-        return f"Error processing request: {e}"
+        return reply_failed(f"Error processing request: {e}")
+
+class InteractionResultCache:
+    """
+    Bounded LRU of interaction results, keyed by command, normalized options and the versions of
+    the caches the command reads. Entries depending on a cache are dropped when it is refreshed;
+    the versions in the key already keep them from being served.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key, content):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = content
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, cache_name):
+        with self._lock:
+            for key in [key for key in self._entries if any(name == cache_name for name, _ in key[2])]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Commands whose result only depends on their options and these caches. Anything not listed is
+# never cached: imagetest reads the attachment, and the static replies (github, spreadsheet, help)
+# are cheaper to build again than to look up.
+INTERACTION_DEPENDENCIES = {
+    "rupturecalc": (rupture_table_cache,),
+    "ruptureplan": (rupture_table_cache,),
+    "leaderboard": (leaderboard_cache,),
+    "watch": (leaderboard_cache,),
+}
+
+interaction_results = InteractionResultCache(INTERACTION_CACHE_ENTRIES)
+for data_cache in (leaderboard_cache, rupture_table_cache):
+    data_cache.add_listener(lambda previous, current, name=data_cache.name: interaction_results.invalidate(name))
+
+
+def interaction_result_key(data):
+    """
+    The cache key for an interaction's data, or None when its result must not be cached: the
+    command is not deterministic, or one of its caches has nothing it could serve without a fetch.
+    """
+    dependencies = INTERACTION_DEPENDENCIES.get(data.get("name", ""))
+    if dependencies is None:
+        return None
+    versions = tuple((cache.name, cache.current_version()) for cache in dependencies)
+    if any(version is None for _, version in versions):
+        return None
+    return data["name"], normalize_options(data.get("options", [])), versions
+
+
+def normalize_options(options):
+    """Options as a hashable tuple that does not depend on the order Discord sent them in."""
+    return tuple(sorted((option.get("name", ""), option.get("value"), normalize_options(option.get("options", []))) for option in options))
+
+
+def cached_interact(raw_request):
+    """
+    `interact` behind the interaction result cache. Replies built from data that could not be
+    refreshed get a note saying how old it is; the cached result itself never includes it.
+    """
+    data = raw_request.get("data", {})
+    key = interaction_result_key(data)
+    content = interaction_results.get(key) if key is not None else None
+    if content is None:
+        failures = []
+        token = _reply_failures.set(failures)
+        try:
+            content = interact(raw_request)
+        finally:
+            _reply_failures.reset(token)
+        # Errors are often transient, so they are answered but never replayed from the cache
+        if key is not None and not failures:
+            interaction_results.put(key, content)
+    return content + "".join(cache.stale_notice() for cache in INTERACTION_DEPENDENCIES.get(data.get("name", ""), ()))
+
 
 # ----------------------------------------------------------------------------
 # ------------------------ INTERACTION FUNCTION ------------------------------
@@ -534,11 +2786,7 @@ def dr_discord_bot_interaction_handler(req: func.HttpRequest) -> func.HttpRespon
         raw_req = req.get_json()
         #logging.info(f"Received request body: {raw_req}")
 
-        content = interact(raw_req)
-        logging.info(f"Interaction result: {content}")
-
-        send_discord_followup(raw_req, content)
-        logging.info('Follow-up sent successfully.')
+        process_interaction(raw_req)
 
         return create_http_response("OK", status_code=200)
 
@@ -548,6 +2796,18 @@ def dr_discord_bot_interaction_handler(req: func.HttpRequest) -> func.HttpRespon
         #return create_http_response("Internal server error", status_code=500)
 
 
+# ----------------------------------------------------------------------------
+# ------------------------ QUEUE TRIGGER FUNCTION ----------------------------
+# ----------------------------------------------------------------------------
+# The host fetches messages in batches (see extensions.queues in host.json) and retries a
+# message that raised, moving it to the poison queue after maxDequeueCount attempts.
+@app.queue_trigger(arg_name="msg", queue_name=INTERACTION_QUEUE_NAME, connection="AzureWebJobsStorage")
+def dr_discord_bot_interaction_consumer(msg: func.QueueMessage) -> None:
+    logging.info(f"Processing queued interaction {msg.id} (dequeue count {msg.dequeue_count})")
+    if process_interaction_batch([msg.get_body().decode("utf-8")]):
+        raise RuntimeError(f"Queued interaction {msg.id} failed")
+
+
 # ----------------------------------------------------------------------------
 # ------------------------ TIMER TRIGGER FUNCTION ----------------------------
 # ----------------------------------------------------------------------------
@@ -559,15 +2819,28 @@ def ping_discordbot_functions(myTimer: func.TimerRequest) -> None:
 
     logging.info('Python timer trigger function executed.')
 
-    body = {"type": "warmup"}
-    
-    func1_url = f"{AZFUNC}/api/dr_discord_bot_handler?code={HANDLER_FUNCTION_KEY}"
-    func2_url = f"{AZFUNC}/api/dr_discord_bot_interaction_handler?code={INTERACTION_FUNCTION_KEY}&warmup='true'"
-    
-    headers = {"Content-Type": "application/json"}
+    if KEEP_WARM_PINGS:
+        body = {"type": "warmup"}
+
+        func1_url = f"{AZFUNC}/api/dr_discord_bot_handler?code={HANDLER_FUNCTION_KEY}"
+        func2_url = f"{AZFUNC}/api/dr_discord_bot_interaction_handler?code={INTERACTION_FUNCTION_KEY}&warmup='true'"
+
+        headers = {"Content-Type": "application/json"}
+
+        response1 = get_http_session().post(func1_url, json=body, headers=headers, timeout=(UPSTREAM_CONNECT_TIMEOUT, 30))
+        response2 = get_http_session().post(func2_url, headers=headers, timeout=(UPSTREAM_CONNECT_TIMEOUT, 30))
 
-    response1 = requests.post(func1_url, json=body, headers=headers)
-    response2 = requests.post(func2_url, headers=headers)
+        logging.info(f"Response from func1: {response1.status_code}")
+        logging.info(f"Response from func2: {response2.status_code}")
 
-    logging.info(f"Response from func1: {response1.status_code}")
-    logging.info(f"Response from func2: {response2.status_code}")
\ No newline at end of file
+    log_latency_histograms()
+
+    try:
+        prefetch_leaderboard_snapshot()
+    except Exception as e:
+        logging.error(f"Failed to prefetch leaderboard snapshot: {e}")
+
+    try:
+        post_leaderboard_changes()
+    except Exception as e:
+        logging.error(f"Failed to post leaderboard changes: {e}")
\ No newline at end of file
@@ -1,3 +1,7 @@
+import argparse
+import difflib
+import hashlib
+import json
 import requests
 import yaml
 import os
@@ -10,9 +14,17 @@ load_dotenv()
 
 DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 DISCORD_BOT_APPLICATION_ID = os.getenv('DISCORD_BOT_APPLICATION_ID')
-URL = f"https://discord.com/api/v10/applications/{DISCORD_BOT_APPLICATION_ID}/commands"
+DISCORD_API_URL = os.getenv("DISCORD_API_URL", "https://discord.com/api/v10")
+URL = f"{DISCORD_API_URL}/applications/{DISCORD_BOT_APPLICATION_ID}/commands"
 headers = {"Authorization": f"Bot {DISCORD_BOT_TOKEN}", "Content-Type": "application/json"}
 
+# The fields that make up a command definition. Everything else Discord returns (id, version,
+# application_id, ...) is bookkeeping, and fields left at their default are dropped.
+COMMAND_FIELDS = {"name": None, "description": None, "type": 1, "options": [], "nsfw": False, "default_member_permissions": None}
+OPTION_FIELDS = {"name": None, "description": None, "type": None, "required": False, "choices": [], "options": [], "autocomplete": False,
+                 "min_value": None, "max_value": None, "min_length": None, "max_length": None, "channel_types": []}
+CHOICE_FIELDS = {"name": None, "value": None}
+
 
 def get_defined_commands():
     with open("discord_commands.yaml", "r") as file:
@@ -21,35 +33,87 @@ def get_defined_commands():
         commands = yaml.safe_load(yaml_content)
         return commands
 
-def cleanup_commands(defined_commands):
-    active_commands = requests.get(URL, headers=headers)
-    defined_command_names = [obj['name'] for obj in defined_commands]
-    for command in active_commands.json():
-        if command['name'] not in defined_command_names:
-            command_id = command["id"]
-            response = requests.delete(f"{URL}/{command_id}", headers=headers)
-            print(f"Command {command_id} deleted: {response.status_code}")
-
-
-def add_commands(defined_commands, commands_to_add):
-    defined_commands = [command for command in defined_commands if command["name"] in commands_to_add]
-    # Send the POST request for each command
-    for command in defined_commands:
-        try:
-            response = requests.post(URL, json=command, headers=headers)
-            response.raise_for_status()
-            print(response)
-        except Exception as e:
-            print(f"Failed: {response.status_code} Exception: {e}")
-        command_name = command["name"]
-        print(f"Command {command_name} created: {response.status_code}")     
+
+def normalize(definition, fields):
+    normalized = {}
+    for field, default in fields.items():
+        value = definition.get(field, default)
+        if value == default:
+            continue
+        if field == "options":
+            value = [normalize(option, OPTION_FIELDS) for option in value]
+        elif field == "choices":
+            value = [normalize(choice, CHOICE_FIELDS) for choice in value]
+        normalized[field] = value
+    return normalized
+
+
+def normalize_commands(commands):
+    """Commands as {name: normalized definition}, so definitions from the yaml and from Discord compare equal."""
+    return {command["name"]: normalize(command, COMMAND_FIELDS) for command in commands}
+
+
+def commands_hash(normalized_commands):
+    return hashlib.sha256(json.dumps(normalized_commands, sort_keys=True).encode()).hexdigest()
+
+
+def diff_commands(live, defined):
+    """
+    Compares two sets of normalized commands.
+
+    Returns:
+        list: Human readable lines naming the added and removed commands and a unified diff of each changed one.
+    """
+    lines = []
+    for name in sorted(live.keys() | defined.keys()):
+        if name not in live:
+            lines.append(f"+ {name} (new)")
+        elif name not in defined:
+            lines.append(f"- {name} (removed)")
+        elif live[name] != defined[name]:
+            lines.append(f"~ {name} (changed)")
+            lines += difflib.unified_diff(json.dumps(live[name], indent=2, sort_keys=True).splitlines(),
+                                          json.dumps(defined[name], indent=2, sort_keys=True).splitlines(),
+                                          fromfile=f"live/{name}", tofile=f"defined/{name}", lineterm="")
+    return lines
+
+
+def sync_commands(defined_commands, dry_run=False):
+    """
+    Brings the live commands in line with `defined_commands`. Does nothing when the normalized
+    definitions already match, otherwise replaces the whole set with one bulk overwrite PUT.
+
+    Returns:
+        bool: True if the live commands match the definitions afterwards (or would, on a dry run).
+    """
+    response = requests.get(URL, headers=headers, timeout=10)
+    response.raise_for_status()
+    live = normalize_commands(response.json())
+    defined = normalize_commands(defined_commands)
+
+    if commands_hash(live) == commands_hash(defined):
+        print(f"Commands are up to date ({len(defined)} commands, {commands_hash(defined)[:12]})")
+        return True
+
+    print("\n".join(diff_commands(live, defined)))
+    if dry_run:
+        print("Dry run, nothing changed.")
+        return True
+
+    response = requests.put(URL, json=defined_commands, headers=headers, timeout=30)
+    if not response.ok:
+        print(f"Failed: {response.status_code} {response.text}")
+        return False
+    print(f"Commands overwritten: {response.status_code} ({len(defined)} commands)")
+    return True
 
 
 def main():
-    commands_to_add = ['imagetest']
-    defined_commands = get_defined_commands()
-    cleanup_commands(defined_commands)
-    add_commands(defined_commands, commands_to_add)
-    
+    parser = argparse.ArgumentParser(description="Sync the slash commands in discord_commands.yaml to Discord.")
+    parser.add_argument("--dry-run", action="store_true", help="only print the difference to the live commands")
+    args = parser.parse_args()
+    return 0 if sync_commands(get_defined_commands(), dry_run=args.dry_run) else 1
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())